@@ -1,19 +1,42 @@
-from collections import namedtuple, defaultdict
+from collections import deque, namedtuple, defaultdict
+
+import numpy as np
+
+from csr import CSRGraph
+from paths import construct_path
 Edge = namedtuple('Edge', ['target', 'weight'])
 
 
-def bellman_ford(graph, source, target):
+# Relaxation strategies selectable with bellman_ford's engine argument.
+# 'passes' relaxes every edge in rounds, stopping after a round that changes
+# nothing. 'spfa' keeps a queue of vertices whose distance changed and only
+# relaxes their outgoing edges.
+ENGINES = ('passes', 'spfa')
+
+
+def bellman_ford(graph, source, target, engine='passes'):
   """
   Given a directed graph (format described below), and source and target
   vertices, returns a shortest path as a list of vertices going from source
   to target, along with the distance of the shortest path, or None if no such
-  path exists and -1 if a negative loop is found. Returned path will not
-  include the source vertex in it. Assumes non-negative weights.
+  path exists. If a negative loop is reachable from source, a list of its
+  vertices in edge order is returned instead. Returned path will not include
+  the source vertex in it.
   The graph parameter is expected to be a dictionary mapping each vertex to a
   list of Edge named tuples indicating the vertex's outgoing edges. For
   example if vertex v has outgoing edges to u and w with weights 10 and 20
   respectively, we have graph[v] = [Edge(u, 10), Edge(w, 20)].
+  The graph may also be given as a CSRGraph, in which case source, target and
+  the returned path use the graph's original vertex labels. Edges of an
+  unweighted CSRGraph count as weight 1.
   """
+  if engine not in ENGINES:
+    raise ValueError('Unknown bellman_ford engine %r, expected one of %s'
+                     % (engine, list(ENGINES)))
+  if engine == 'spfa':
+    return _spfa(graph, source, target)
+  if isinstance(graph, CSRGraph):
+    return _bellman_ford_csr(graph, source, target)
   # previous_vertex[v] holds the immediate vertex before v in the shortest
   # path from source to v. This dictionary also acts as our "visited" set
   # since we set previous_vertex[v] as soon as the vertex enters our queue.
@@ -27,36 +50,167 @@ def bellman_ford(graph, source, target):
   # we have the shortest path to by one. This means at the end we have the
   # shortest path to 1 + (n - 1) = n vertices.
   for i in range(len(graph) - 1):
+    changed = False
     for v in graph:
       for edge in graph[v]:
         alt_distance = shortest_distance[v] + edge.weight
         if alt_distance < shortest_distance[edge.target]:
           shortest_distance[edge.target] = alt_distance
           previous_vertex[edge.target] = v
+          changed = True
+    # Once a pass changes nothing no later pass can either.
+    if not changed:
+      break
   # Final loop over all edges to check for negative loops. If at this point
-  # we find a shorter alternative path it means a negative loop exists.
+  # we find a shorter alternative path it means a negative loop exists, and
+  # once that edge is relaxed the previous_vertex links close into it.
   for v in graph:
     for edge in graph[v]:
       alt_distance = shortest_distance[v] + edge.weight
       if alt_distance < shortest_distance[edge.target]:
-        return -1
+        shortest_distance[edge.target] = alt_distance
+        previous_vertex[edge.target] = v
+        return _negative_cycle(previous_vertex, source,
+                               shortest_distance[source])
   if shortest_distance[target] < float('inf'):
     return (shortest_distance[target],
-        _construct_path(previous_vertex, source, target))
+        construct_path(previous_vertex, source, target))
   return None
 
 
-def _construct_path(previous_vertex, source, target):
-  if source == target:
-    return []
-  return _construct_path(previous_vertex, source,
-               previous_vertex[target]) + [target]
-               
-               
-               
-import unittest
+def _bellman_ford_csr(graph, source, target):
+  source = graph.vertex_index[source]
+  target = graph.vertex_index.get(target)
+  n = graph.num_vertices
+  sources, targets, weights = graph.edge_sources(), graph.indices, graph.weights
+  if weights is None:
+    weights = np.ones(graph.num_edges)
+  previous_vertex = np.full(n, -1, dtype=np.int64)
+  previous_vertex[source] = source
+  shortest_distance = np.full(n, np.inf)
+  shortest_distance[source] = 0
+  # Each pass relaxes every edge at once against the distances of the
+  # previous pass. That still settles one more hop of every shortest path per
+  # pass, so n - 1 passes suffice, and we can stop early once nothing moves.
+  for i in range(n):
+    alt_distance = shortest_distance[sources] + weights
+    improved = np.flatnonzero(alt_distance < shortest_distance[targets])
+    if not len(improved):
+      break
+    improved_targets = targets[improved]
+    np.minimum.at(shortest_distance, improved_targets, alt_distance[improved])
+    # Several edges may improve the same target; keep one that achieved the
+    # new minimum as its predecessor.
+    best = alt_distance[improved] == shortest_distance[improved_targets]
+    previous_vertex[improved_targets[best]] = sources[improved[best]]
+    if i == n - 1:
+      # Still improving after n - 1 passes means a negative loop exists, and
+      # the previous_vertex links now close into it.
+      reached = np.flatnonzero(previous_vertex >= 0)
+      links = dict(zip(reached.tolist(), previous_vertex[reached].tolist()))
+      return graph.to_labels(_negative_cycle(links, source,
+                                             shortest_distance[source]))
+  if target is not None and shortest_distance[target] < np.inf:
+    return (shortest_distance[target],
+        graph.to_labels(construct_path(previous_vertex, source, target)))
+  return None
+
+
+def _spfa(graph, source, target):
+  if isinstance(graph, CSRGraph):
+    source = graph.vertex_index[source]
+    target = graph.vertex_index.get(target)
+    indptr, indices, weights = graph.indptr, graph.indices, graph.weights
+    if weights is None:
+      weights = np.ones(graph.num_edges)
+    def out_edges(v):
+      start, end = indptr[v], indptr[v + 1]
+      return zip(indices[start:end].tolist(), weights[start:end].tolist())
+    result = _spfa_search(out_edges, graph.num_vertices, source, target)
+    if result is None:
+      return None
+    if isinstance(result, list):
+      return graph.to_labels(result)
+    return (result[0], graph.to_labels(result[1]))
+  # Edge named tuples already unpack as (target, weight).
+  return _spfa_search(graph.__getitem__, len(graph), source, target)
+
+
+def _spfa_search(out_edges, num_vertices, source, target):
+  inf = float('inf')
+  previous_vertex = {source: source}
+  shortest_distance = {source: 0}
+  q = deque([source])
+  queued = {source}
+  relaxations = 0
+  while q:
+    v = q.popleft()
+    queued.discard(v)
+    distance = shortest_distance[v]
+    for w, weight in out_edges(v):
+      alt_distance = distance + weight
+      if alt_distance < shortest_distance.get(w, inf):
+        shortest_distance[w] = alt_distance
+        previous_vertex[w] = v
+        if w not in queued:
+          queued.add(w)
+          q.append(w)
+        # Without a negative loop the queue eventually drains. With one, the
+        # predecessor links eventually close into a cycle, so look for one
+        # after every num_vertices relaxations, which costs O(1) amortized.
+        relaxations += 1
+        if relaxations == num_vertices:
+          relaxations = 0
+          cycle = _negative_cycle(previous_vertex, source,
+                                  shortest_distance[source])
+          if cycle is not None:
+            return cycle
+  if target in shortest_distance:
+    return (shortest_distance[target],
+        construct_path(previous_vertex, source, target))
+  return None
 
 
+def _negative_cycle(previous_vertex, source, source_distance):
+  """
+  Returns the cycle formed by the previous_vertex links of a search from
+  source, as found by _predecessor_cycle, or None if there is none yet.
+  """
+  # The source only ever improves by going around a negative loop, after
+  # which its link is a real one rather than the root marker.
+  root = source if source_distance == 0 else None
+  return _predecessor_cycle(previous_vertex, root)
+
+
+def _predecessor_cycle(previous_vertex, root):
+  """
+  Returns the vertices of a cycle formed by the previous_vertex links, in
+  edge order, or None if they form a tree. The root's link to itself does
+  not count as a cycle.
+  """
+  walk_of = {}
+  for start in previous_vertex:
+    v = start
+    while v not in walk_of:
+      walk_of[v] = start
+      if v == root:
+        break
+      v = previous_vertex[v]
+    else:
+      # The walk ran into a vertex it had already passed, closing a cycle.
+      if walk_of[v] == start:
+        cycle = [v]
+        u = previous_vertex[v]
+        while u != v:
+          cycle.append(u)
+          u = previous_vertex[u]
+        cycle.reverse()
+        return cycle
+  return None
+
+
+
+import unittest
 
 class BellmanFordTest(unittest.TestCase):
   def test_single_vertex(self):
@@ -87,7 +241,10 @@ class BellmanFordTest(unittest.TestCase):
       1: [Edge(target=0, weight=10), Edge(target=2, weight=10)],
       2: [Edge(target=0, weight=-30), Edge(target=1, weight=30)],
     }
-    self.assertEqual(bellman_ford(graph, 0, 2), -1)
+    self.assertEqual(sorted(bellman_ford(graph, 0, 2)), [0, 1, 2])
+  def test_negative_self_loop_at_source(self):
+    graph = {0: [Edge(target=0, weight=-1)]}
+    self.assertEqual(bellman_ford(graph, 0, 0), [0])
   def test_clrs_example(self):
     graph = {
       's': [
@@ -122,3 +279,116 @@ class BellmanFordTest(unittest.TestCase):
       ['t', 'x'],
       ['y', 'x'],
     ])
+
+
+class BellmanFordCSRTest(unittest.TestCase):
+  def test_single_vertex(self):
+    graph = CSRGraph.from_dict({0: []})
+    self.assertEqual(bellman_ford(graph, 0, 0), (0, []))
+  def test_two_vertices_no_path(self):
+    graph = CSRGraph.from_dict({
+      0: [],
+      1: [Edge(target=0, weight=10)],
+    })
+    self.assertEqual(bellman_ford(graph, 0, 1), None)
+  def test_cycle_3(self):
+    graph = CSRGraph.from_dict({
+      0: [Edge(target=1, weight=10), Edge(target=2, weight=30)],
+      1: [Edge(target=0, weight=10), Edge(target=2, weight=10)],
+      2: [Edge(target=0, weight=30), Edge(target=1, weight=30)],
+    })
+    self.assertEqual(bellman_ford(graph, 0, 2), (20, [1, 2]))
+  def test_negative_cycle_3(self):
+    graph = CSRGraph.from_dict({
+      0: [Edge(target=1, weight=10), Edge(target=2, weight=30)],
+      1: [Edge(target=0, weight=10), Edge(target=2, weight=10)],
+      2: [Edge(target=0, weight=-30), Edge(target=1, weight=30)],
+    })
+    self.assertEqual(sorted(bellman_ford(graph, 0, 2)), [0, 1, 2])
+  def test_negative_edge(self):
+    graph = CSRGraph.from_dict({
+      's': [Edge(target='a', weight=4), Edge(target='b', weight=1)],
+      'b': [Edge(target='a', weight=-2)],
+      'a': [Edge(target='t', weight=1)],
+    })
+    self.assertEqual(bellman_ford(graph, 's', 't'), (0, ['b', 'a', 't']))
+
+
+class SPFATest(unittest.TestCase):
+  def assertNegativeCycle(self, graph, cycle):
+    total = 0
+    for v, w in zip(cycle, cycle[1:] + cycle[:1]):
+      total += min(e.weight for e in graph[v] if e.target == w)
+    self.assertLess(total, 0)
+  def test_unknown_engine(self):
+    self.assertRaises(ValueError, bellman_ford, {0: []}, 0, 0, 'dijkstra')
+  def test_matches_passes(self):
+    graph = {
+      's': [Edge(target='t', weight=6), Edge(target='y', weight=7)],
+      't': [Edge(target='x', weight=5), Edge(target='y', weight=8),
+            Edge(target='z', weight=-4)],
+      'x': [Edge(target='t', weight=-2)],
+      'y': [Edge(target='x', weight=-3), Edge(target='z', weight=9)],
+      'z': [Edge(target='s', weight=2), Edge(target='x', weight=7)],
+      'u': [],
+    }
+    for g in (graph, CSRGraph.from_dict(graph)):
+      for v in graph:
+        for w in graph:
+          self.assertEqual(bellman_ford(g, v, w, engine='spfa'),
+                           bellman_ford(graph, v, w))
+  def test_negative_cycle_3(self):
+    graph = {
+      0: [Edge(target=1, weight=10), Edge(target=2, weight=30)],
+      1: [Edge(target=0, weight=10), Edge(target=2, weight=10)],
+      2: [Edge(target=0, weight=-30), Edge(target=1, weight=30)],
+    }
+    for g in (graph, CSRGraph.from_dict(graph)):
+      cycle = bellman_ford(g, 0, 2, engine='spfa')
+      self.assertEqual(sorted(cycle), [0, 1, 2])
+      self.assertNegativeCycle(graph, cycle)
+  def test_negative_cycle_away_from_source(self):
+    graph = {
+      'a': [Edge(target='b', weight=1)],
+      'b': [Edge(target='c', weight=1)],
+      'c': [Edge(target='d', weight=-1), Edge(target='e', weight=4)],
+      'd': [Edge(target='b', weight=-1)],
+      'e': [],
+    }
+    for g in (graph, CSRGraph.from_dict(graph)):
+      for engine in ENGINES:
+        cycle = bellman_ford(g, 'a', 'e', engine=engine)
+        self.assertEqual(sorted(cycle), ['b', 'c', 'd'])
+        self.assertNegativeCycle(graph, cycle)
+  def test_engines_agree_on_random_graphs(self):
+    rng = np.random.RandomState(0)
+    for _ in range(50):
+      n = rng.randint(1, 8)
+      graph = {v: [] for v in range(n)}
+      for _ in range(rng.randint(0, 3 * n)):
+        graph[rng.randint(n)].append(Edge(target=rng.randint(n),
+                                          weight=rng.randint(-3, 10)))
+      for g in (graph, CSRGraph.from_dict(graph)):
+        results = [bellman_ford(g, 0, n - 1, engine=engine)
+                   for engine in ENGINES]
+        self.assertEqual(isinstance(results[0], list),
+                         isinstance(results[1], list))
+        for result in results:
+          if isinstance(result, list):
+            self.assertNegativeCycle(graph, result)
+          else:
+            self.assertEqual(result, results[1])
+  def test_negative_self_loop_at_source(self):
+    graph = {
+      0: [Edge(target=0, weight=-1), Edge(target=1, weight=1)],
+      1: [],
+    }
+    self.assertEqual(bellman_ford(graph, 0, 1, engine='spfa'), [0])
+  def test_unreachable_negative_cycle(self):
+    graph = {
+      0: [Edge(target=1, weight=2)],
+      1: [],
+      2: [Edge(target=3, weight=-5)],
+      3: [Edge(target=2, weight=1)],
+    }
+    self.assertEqual(bellman_ford(graph, 0, 1, engine='spfa'), (2, [1]))
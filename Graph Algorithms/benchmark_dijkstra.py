@@ -0,0 +1,57 @@
+"""
+Times dijkstra's priority queue engines against each other on a random
+graph, in both the dictionary and the CSRGraph format. Every search is given
+a target that does not exist, so it settles every reachable vertex.
+
+  python benchmark_dijkstra.py [num_vertices] [num_edges] [repeats]
+"""
+import sys
+import time
+
+import numpy as np
+
+from csr import CSRGraph
+from dijkstra import ENGINES, Edge, dijkstra
+
+
+def random_graphs(n, m, seed=0):
+  """
+  Returns the same random graph with n vertices, m edges and integer weights
+  in [1, 100) as a dictionary graph and as a CSRGraph.
+  """
+  rng = np.random.RandomState(seed)
+  sources, targets = rng.randint(0, n, m), rng.randint(0, n, m)
+  weights = rng.randint(1, 100, m).astype(float)
+  graph = {v: [] for v in range(n)}
+  for v, w, weight in zip(sources.tolist(), targets.tolist(),
+                          weights.tolist()):
+    graph[v].append(Edge(w, weight))
+  return graph, CSRGraph.from_edges(sources, targets, weights, num_vertices=n)
+
+
+def time_engines(graph, repeats):
+  """Returns the best of repeats wall-clock times for each engine."""
+  timings = {}
+  for engine in sorted(ENGINES):
+    runs = []
+    for _ in range(repeats):
+      start = time.time()
+      dijkstra(graph, 0, -1, engine=engine)
+      runs.append(time.time() - start)
+    timings[engine] = min(runs)
+  return timings
+
+
+def main(argv):
+  n = int(argv[1]) if len(argv) > 1 else 200000
+  m = int(argv[2]) if len(argv) > 2 else 8 * n
+  repeats = int(argv[3]) if len(argv) > 3 else 1
+  graph, csr_graph = random_graphs(n, m)
+  for name, g in (('dict', graph), ('csr', csr_graph)):
+    timings = time_engines(g, repeats)
+    print('%-4s %s' % (name, '  '.join('%s %.2fs' % (engine, t)
+                                       for engine, t in sorted(timings.items()))))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
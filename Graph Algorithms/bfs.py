@@ -1,37 +1,155 @@
 from collections import deque
 
+import numpy as np
 
-def bfs(graph, source, target):
+from csr import CSRGraph
+from paths import construct_path
+
+
+# Direction-optimizing BFS switches to bottom-up steps once the edges out of
+# the frontier outnumber the edges into unvisited vertices by this factor,
+# and back to top-down steps once the frontier holds fewer than this fraction
+# of the vertices (Beamer et al.'s alpha and beta).
+BOTTOM_UP_EDGE_FACTOR = 14
+TOP_DOWN_VERTEX_FRACTION = 1.0 / 24
+
+
+def bfs(graph, source, target=None, direction='auto'):
   """
   Given a directed graph (format described below), and source and target
   vertices, returns a shortest unweighted path as a list of vertices going
   from source to target, or None if no such path exists. Returned path will
-  not include the source vertex in it.
+  not include the source vertex in it. If target is omitted, returns the
+  unweighted distance from source to every vertex reachable from it instead.
   The graph parameter is expected to be a dictionary mapping each vertex to a
   list of vertices indicating outgoing edges. For example if vertex v has
-  outgoing edges to u and w we have graph[v] = [u, w].
+  outgoing edges to u and w we have graph[v] = [u, w]. Distances are then
+  returned as a dictionary mapping vertex to distance.
+  The graph may also be given as a CSRGraph, in which case source, target and
+  the returned path use the graph's original vertex labels, and distances
+  are returned as an array indexed by vertex id with -1 for unreachable
+  vertices. A CSRGraph is searched one whole level at a time with NumPy
+  operations. direction picks how each level is expanded: 'top_down' scans
+  the edges out of the frontier, 'bottom_up' scans the edges into unvisited
+  vertices, and 'auto' picks whichever should touch fewer edges. Bottom-up
+  steps use CSRGraph.in_edges, which is built on first use and kept on the
+  graph. All three return the same path as the dictionary version.
   """
+  if isinstance(graph, CSRGraph):
+    return _bfs_csr(graph, source, target, direction)
   q = deque([source])
   # previous_vertex[v] holds the immediate vertex before v in the shortest
   # path from source to v. This dictionary also acts as our "visited" set
   # since we set previous_vertex[v] as soon as the vertex enters our queue.
   previous_vertex = {source: source}
+  distance = {source: 0}
   while q:
     v = q.popleft()
     if v == target:
-      return _construct_path(previous_vertex, source, target)
+      return construct_path(previous_vertex, source, target)
     for w in graph[v]:
       if w not in previous_vertex:
         previous_vertex[w] = v
+        distance[w] = distance[v] + 1
         q.append(w)
-  return None
+  return distance if target is None else None
+
+
+def _bfs_csr(graph, source, target, direction):
+  if direction not in ('auto', 'top_down', 'bottom_up'):
+    raise ValueError('Unknown bfs direction %r' % (direction,))
+  source = graph.vertex_index[source]
+  if target is not None:
+    if target not in graph.vertex_index:
+      return None
+    target = graph.vertex_index[target]
+  n = graph.num_vertices
+  degree = np.diff(graph.indptr)
+  distance = np.full(n, -1, dtype=np.int64)
+  distance[source] = 0
+  previous_vertex = np.full(n, -1, dtype=np.int64)
+  previous_vertex[source] = source
+  in_edges = None
+  if direction != 'top_down':
+    in_edges = graph.in_edges()
+    in_degree = np.diff(in_edges[0])
+    unvisited_in_edges = graph.num_edges - in_degree[source]
+  bottom_up = direction == 'bottom_up'
+  # The frontier is kept in the order a queue-based BFS would dequeue it, so
+  # every vertex gets the same predecessor as in the dictionary version.
+  frontier = np.array([source], dtype=np.int64)
+  level = 0
+  while len(frontier) and (target is None or distance[target] < 0):
+    level += 1
+    if direction == 'auto':
+      if bottom_up:
+        bottom_up = len(frontier) >= n * TOP_DOWN_VERTEX_FRACTION
+      else:
+        bottom_up = (degree[frontier].sum() * BOTTOM_UP_EDGE_FACTOR
+                     > unvisited_in_edges)
+    if bottom_up:
+      frontier, parents = _bottom_up_step(graph, in_edges, distance, frontier)
+    else:
+      frontier, parents = _top_down_step(graph, distance, frontier)
+    distance[frontier] = level
+    previous_vertex[frontier] = parents
+    if in_edges is not None:
+      unvisited_in_edges -= in_degree[frontier].sum()
+  if target is None:
+    return distance
+  if distance[target] < 0:
+    return None
+  return graph.to_labels(construct_path(previous_vertex, source, target))
+
+
+def _gather(indptr, vertices):
+  """
+  Returns the positions of all edges of the given vertices in an indptr-style
+  layout, concatenated in vertex order, along with each edge's vertex.
+  """
+  counts = indptr[vertices + 1] - indptr[vertices]
+  total = counts.sum()
+  offsets = np.repeat(indptr[vertices] - (np.cumsum(counts) - counts), counts)
+  return offsets + np.arange(total), np.repeat(vertices, counts)
+
 
+def _top_down_step(graph, distance, frontier):
+  edges, parents = _gather(graph.indptr, frontier)
+  neighbors = graph.indices[edges]
+  new = distance[neighbors] < 0
+  neighbors, parents = neighbors[new], parents[new]
+  # A queue would discover each vertex from its first occurrence in the
+  # frontier's concatenated adjacency lists.
+  _, first = np.unique(neighbors, return_index=True)
+  first.sort()
+  return neighbors[first], parents[first]
 
-def _construct_path(previous_vertex, source, target):
-  if source == target:
-    return []
-  return _construct_path(previous_vertex, source,
-               previous_vertex[target]) + [target]
+
+def _bottom_up_step(graph, in_edges, distance, frontier):
+  in_indptr, in_sources, in_edge_ids = in_edges
+  position = np.full(graph.num_vertices, -1, dtype=np.int64)
+  position[frontier] = np.arange(len(frontier))
+  unvisited = np.flatnonzero(distance < 0)
+  unvisited = unvisited[in_indptr[unvisited + 1] > in_indptr[unvisited]]
+  edges, _ = _gather(in_indptr, unvisited)
+  parent_position = position[in_sources[edges]]
+  # Rank every incoming edge the way a top-down step would meet it: by the
+  # parent's place in the frontier, then by the edge's place in the parent's
+  # adjacency list. Edges from outside the frontier rank last.
+  num_edges = max(graph.num_edges, 1)
+  unreached = len(frontier) * num_edges
+  key = np.where(parent_position >= 0,
+                 parent_position * num_edges + in_edge_ids[edges], unreached)
+  # Each unvisited vertex's incoming edges are contiguous, so its best edge
+  # is a segmented minimum.
+  if not len(unvisited):
+    return unvisited, unvisited
+  counts = in_indptr[unvisited + 1] - in_indptr[unvisited]
+  best = np.minimum.reduceat(key, np.cumsum(counts) - counts)
+  found = best < unreached
+  children, best = unvisited[found], best[found]
+  order = np.argsort(best)
+  return children[order], frontier[best[order] // num_edges]
 
 
 #And the accompanied unit test:
@@ -75,3 +193,82 @@ class BFSTest(unittest.TestCase):
     }
     self.assertEqual(bfs(graph, 0, 2), [1, 2])
     self.assertEqual(bfs(graph, 0, 3), [4, 3])
+
+
+class BFSCSRTest(unittest.TestCase):
+  def test_single_vertex(self):
+    graph = CSRGraph.from_dict({0: []})
+    self.assertEqual(bfs(graph, 0, 0), [])
+  def test_two_vertices_no_path(self):
+    graph = CSRGraph.from_dict({
+      0: [],
+      1: [],
+    })
+    self.assertEqual(bfs(graph, 0, 1), None)
+  def test_labelled_vertices(self):
+    graph = CSRGraph.from_dict({
+      'a': ['b', 'c'],
+      'b': ['d'],
+      'c': ['d'],
+      'd': [],
+    })
+    self.assertEqual(bfs(graph, 'a', 'd'), ['b', 'd'])
+    self.assertEqual(bfs(graph, 'd', 'a'), None)
+  def test_cycle_5(self):
+    graph = CSRGraph.from_dict({
+      0: [4, 1],
+      1: [0, 2],
+      2: [1, 3],
+      3: [2, 4],
+      4: [3, 0],
+    })
+    self.assertEqual(bfs(graph, 0, 2), [1, 2])
+    self.assertEqual(bfs(graph, 0, 3), [4, 3])
+  def test_distances(self):
+    graph = CSRGraph.from_dict({
+      'a': ['b', 'c'],
+      'b': ['d'],
+      'c': ['d'],
+      'd': [],
+      'e': ['a'],
+    })
+    for direction in ('auto', 'top_down', 'bottom_up'):
+      self.assertEqual(bfs(graph, 'a', direction=direction).tolist(),
+                       [0, 1, 1, 2, -1])
+  def test_unknown_direction(self):
+    graph = CSRGraph.from_dict({0: []})
+    self.assertRaises(ValueError, bfs, graph, 0, 0, 'sideways')
+  def test_directions_match_queue_bfs(self):
+    rng = np.random.RandomState(0)
+    for n in (1, 5, 30, 200):
+      graph = {v: rng.randint(0, n, size=rng.randint(0, 6)).tolist()
+               for v in range(n)}
+      csr_graph = CSRGraph.from_dict(graph)
+      expected = bfs(graph, 0)
+      for direction in ('auto', 'top_down', 'bottom_up'):
+        distances = bfs(csr_graph, 0, direction=direction)
+        self.assertEqual(
+            {csr_graph.label(v): d for v, d in enumerate(distances.tolist())
+             if d >= 0},
+            expected)
+        for w in range(n):
+          self.assertEqual(bfs(csr_graph, 0, w, direction), bfs(graph, 0, w))
+
+
+class BFSDistancesTest(unittest.TestCase):
+  def test_cycle_5(self):
+    graph = {
+      0: [4, 1],
+      1: [0, 2],
+      2: [1, 3],
+      3: [2, 4],
+      4: [3, 0],
+    }
+    self.assertEqual(bfs(graph, 0), {0: 0, 1: 1, 2: 2, 3: 2, 4: 1})
+  def test_unreachable_vertices_are_omitted(self):
+    graph = {
+      0: [1],
+      1: [],
+      2: [0],
+    }
+    self.assertEqual(bfs(graph, 0), {0: 0, 1: 1})
@@ -0,0 +1,366 @@
+import numbers
+
+import numpy as np
+
+
+def _index_dtype(n):
+  # Vertex ids are stored in the narrowest integer type that can hold them,
+  # which halves the size of the indices array for graphs below 2^31 vertices.
+  return np.int32 if n < 2 ** 31 else np.int64
+
+
+def _count_columns(path, delimiter, comments):
+  # Returns the number of fields on the first line that is not blank or a
+  # comment, or 0 if there is no such line.
+  with open(path) as fh:
+    for line in fh:
+      if comments:
+        line = line.split(comments, 1)[0]
+      if line.strip():
+        return len(line.split(delimiter))
+  return 0
+
+
+class SortedVertexIndex(object):
+  """
+  A read-only mapping from vertex label to vertex id for a graph whose labels
+  are a strictly increasing array, or the identity when labels is None.
+  Lookups are binary searches, so unlike a dictionary it needs no Python
+  object per vertex.
+  """
+  def __init__(self, labels, num_vertices):
+    self.labels = labels
+    self.num_vertices = num_vertices
+
+  def get(self, label, default=None):
+    if self.labels is None:
+      if (isinstance(label, numbers.Integral)
+          and 0 <= label < self.num_vertices):
+        return int(label)
+      return default
+    try:
+      v = int(np.searchsorted(self.labels, label))
+    except (TypeError, ValueError):
+      return default
+    if v < self.num_vertices and self.labels[v] == label:
+      return v
+    return default
+
+  def __getitem__(self, label):
+    v = self.get(label)
+    if v is None:
+      raise KeyError(label)
+    return v
+
+  def __contains__(self, label):
+    return self.get(label) is not None
+
+  def __len__(self):
+    return self.num_vertices
+
+
+class CSRGraph(object):
+  """
+  A directed graph in compressed sparse row format. Vertices are relabelled
+  to the integers 0 to n - 1; the outgoing edges of vertex v are
+  indices[indptr[v]:indptr[v + 1]], with matching weights in the same slice
+  of weights (or weights is None for an unweighted graph). label(v) is the
+  original name of vertex v and vertex_index maps it back to v.
+  Labels may be None, meaning every vertex is named by its own id, a NumPy
+  array, or any other sequence. The first two are stored without a Python
+  object per vertex.
+  """
+  def __init__(self, indptr, indices, weights=None, labels=None):
+    self.indptr = np.asarray(indptr, dtype=np.int64)
+    n = len(self.indptr) - 1
+    self.indices = np.asarray(indices, dtype=_index_dtype(n))
+    self.weights = (None if weights is None
+                    else np.asarray(weights, dtype=np.float64))
+    if labels is not None:
+      if not isinstance(labels, np.ndarray):
+        labels = list(labels)
+      if len(labels) != n:
+        raise ValueError('Expected %d labels, got %d' % (n, len(labels)))
+    self._labels = labels
+    self._vertex_index = None
+    self._in_edges = None
+
+  @classmethod
+  def from_edges(cls, sources, targets, weights=None, labels=None,
+                 num_vertices=None):
+    """
+    Builds a graph from parallel arrays of integer source and target ids
+    (and optionally weights). Edges keep their input order within each
+    source vertex.
+    """
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    if num_vertices is None:
+      if labels is not None:
+        num_vertices = len(labels)
+      elif len(sources):
+        num_vertices = int(max(sources.max(), targets.max())) + 1
+      else:
+        num_vertices = 0
+    order = np.argsort(sources, kind='stable')
+    indptr = np.zeros(num_vertices + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=num_vertices), out=indptr[1:])
+    if weights is not None:
+      weights = np.asarray(weights, dtype=np.float64)[order]
+    return cls(indptr, targets[order], weights, labels)
+
+  @classmethod
+  def from_dict(cls, graph):
+    """
+    Builds a graph from the dictionary format used by the rest of this
+    module: graph[v] is either a list of vertices or a list of Edge named
+    tuples with target and weight fields. Vertices only seen as edge targets
+    are numbered after the dictionary keys.
+    """
+    vertex_index = {v: i for i, v in enumerate(graph)}
+    labels = list(graph)
+    sources, targets, weights = [], [], []
+    weighted = None
+    for v, edges in graph.items():
+      for edge in edges:
+        if weighted is None:
+          weighted = hasattr(edge, 'weight')
+        w = edge.target if weighted else edge
+        if w not in vertex_index:
+          vertex_index[w] = len(labels)
+          labels.append(w)
+        sources.append(vertex_index[v])
+        targets.append(vertex_index[w])
+        if weighted:
+          weights.append(edge.weight)
+    return cls.from_edges(sources, targets, weights if weighted else None,
+                          labels)
+
+  @classmethod
+  def from_edge_list(cls, path, vertex_type=int, delimiter=None,
+                     comments='#'):
+    """
+    Builds a graph from a text file with one "source target [weight]" edge
+    per line. Vertex names are converted with vertex_type and relabelled in
+    sorted order; the graph is weighted if the file has a third column.
+    """
+    columns = _count_columns(path, delimiter, comments)
+    if columns == 0:
+      return cls(np.zeros(1, dtype=np.int64), [])
+    vertex_dtype = np.dtype(vertex_type)
+    if vertex_dtype.kind not in 'iuf':
+      # Non-numeric names have no fixed width, so read them as strings.
+      data = np.loadtxt(path, dtype=str, delimiter=delimiter,
+                        comments=comments, ndmin=2)
+      endpoints = data[:, :2].astype(vertex_type)
+      weights = data[:, 2].astype(np.float64) if columns > 2 else None
+    else:
+      # Numeric columns are parsed straight into typed fields, without
+      # building a string for every field first.
+      fields = [('source', vertex_dtype), ('target', vertex_dtype)]
+      if columns > 2:
+        fields.append(('weight', np.float64))
+      data = np.loadtxt(path, dtype=fields, delimiter=delimiter,
+                        comments=comments, usecols=range(len(fields)),
+                        ndmin=1)
+      endpoints = np.stack((data['source'], data['target']), axis=1)
+      weights = data['weight'] if columns > 2 else None
+    labels, ids = np.unique(endpoints, return_inverse=True)
+    ids = ids.reshape(-1, 2)
+    n = len(labels)
+    if labels.dtype.kind in 'iu' and labels[0] == 0 and labels[-1] == n - 1:
+      # The names are already 0 to n - 1.
+      labels = None
+    return cls.from_edges(ids[:, 0], ids[:, 1], weights, labels, n)
+
+  @property
+  def labels(self):
+    """The sequence of original vertex names, indexed by vertex id."""
+    if self._labels is None:
+      return range(self.num_vertices)
+    return self._labels
+
+  @property
+  def vertex_index(self):
+    """
+    Maps an original vertex name to its id. Built on first use: identity and
+    sorted array labels are searched in place, other labels get a dictionary.
+    """
+    if self._vertex_index is None:
+      labels = self._labels
+      if labels is None or (isinstance(labels, np.ndarray)
+                            and labels.dtype.kind != 'O'
+                            and np.all(labels[1:] > labels[:-1])):
+        self._vertex_index = SortedVertexIndex(labels, self.num_vertices)
+      else:
+        self._vertex_index = {label: v for v, label in enumerate(labels)}
+    return self._vertex_index
+
+  @property
+  def num_vertices(self):
+    return len(self.indptr) - 1
+
+  @property
+  def num_edges(self):
+    return len(self.indices)
+
+  def __len__(self):
+    return self.num_vertices
+
+  def neighbors(self, v):
+    """Returns the array of vertex ids v has outgoing edges to."""
+    return self.indices[self.indptr[v]:self.indptr[v + 1]]
+
+  def edge_weights(self, v):
+    """Returns the weights of v's outgoing edges, aligned with neighbors."""
+    return self.weights[self.indptr[v]:self.indptr[v + 1]]
+
+  def edge_sources(self):
+    """Returns the source vertex id of every edge, aligned with indices."""
+    return np.repeat(np.arange(self.num_vertices, dtype=self.indices.dtype),
+                     np.diff(self.indptr))
+
+  def in_edges(self):
+    """
+    Returns the incoming edges of every vertex as (in_indptr, sources,
+    edge_ids): the incoming edges of v are sources[in_indptr[v]:in_indptr[v +
+    1]], and edge_ids gives the position of each one in indices. Computed on
+    first use and kept for later calls.
+    """
+    if self._in_edges is None:
+      edge_ids = np.argsort(self.indices, kind='stable')
+      in_indptr = np.zeros(self.num_vertices + 1, dtype=np.int64)
+      np.cumsum(np.bincount(self.indices, minlength=self.num_vertices),
+                out=in_indptr[1:])
+      self._in_edges = (in_indptr, self.edge_sources()[edge_ids], edge_ids)
+    return self._in_edges
+
+  def reverse(self):
+    """Returns the graph with every edge reversed, sharing vertex labels."""
+    reversed_graph = CSRGraph.from_edges(self.indices, self.edge_sources(),
+                                         self.weights, self._labels,
+                                         self.num_vertices)
+    reversed_graph._vertex_index = self.vertex_index
+    return reversed_graph
+
+  def label(self, v):
+    """Returns the original name of vertex id v."""
+    if self._labels is None:
+      return int(v)
+    if isinstance(self._labels, np.ndarray):
+      return self._labels[v].item()
+    return self._labels[v]
+
+  def to_labels(self, vertices):
+    """Maps a sequence of vertex ids back to the original vertex names."""
+    if self._labels is None:
+      return np.asarray(vertices, dtype=np.int64).tolist()
+    if isinstance(self._labels, np.ndarray):
+      return self._labels[np.asarray(vertices, dtype=np.int64)].tolist()
+    return [self._labels[v] for v in vertices]
+
+
+
+import os
+import tempfile
+import unittest
+from collections import namedtuple
+Edge = namedtuple('Edge', ['target', 'weight'])
+
+class CSRGraphTest(unittest.TestCase):
+  def test_empty_graph(self):
+    g = CSRGraph.from_dict({})
+    self.assertEqual(g.num_vertices, 0)
+    self.assertEqual(g.num_edges, 0)
+  def test_unweighted_dict(self):
+    g = CSRGraph.from_dict({
+      'a': ['b', 'c'],
+      'b': ['c'],
+      'c': [],
+    })
+    self.assertEqual(g.labels, ['a', 'b', 'c'])
+    self.assertEqual(g.indptr.tolist(), [0, 2, 3, 3])
+    self.assertEqual(g.indices.tolist(), [1, 2, 2])
+    self.assertIsNone(g.weights)
+  def test_weighted_dict_keeps_edge_order(self):
+    g = CSRGraph.from_dict({
+      0: [Edge(target=2, weight=5), Edge(target=1, weight=3)],
+      1: [],
+    })
+    self.assertEqual(g.labels, [0, 1, 2])
+    self.assertEqual(g.neighbors(0).tolist(), [2, 1])
+    self.assertEqual(g.edge_weights(0).tolist(), [5, 3])
+    self.assertEqual(g.neighbors(2).tolist(), [])
+  def test_target_only_vertices_are_added(self):
+    g = CSRGraph.from_dict({'x': ['y']})
+    self.assertEqual(g.labels, ['x', 'y'])
+    self.assertEqual(g.vertex_index['y'], 1)
+  def test_from_edges(self):
+    g = CSRGraph.from_edges([2, 0, 2], [0, 1, 1], [1.5, 2.5, 3.5])
+    self.assertEqual(g.indptr.tolist(), [0, 1, 1, 3])
+    self.assertEqual(g.indices.tolist(), [1, 0, 1])
+    self.assertEqual(g.weights.tolist(), [2.5, 1.5, 3.5])
+    self.assertEqual(g.edge_sources().tolist(), [0, 2, 2])
+  def test_reverse(self):
+    g = CSRGraph.from_dict({
+      'a': [Edge(target='b', weight=1), Edge(target='c', weight=2)],
+      'b': [Edge(target='c', weight=3)],
+    }).reverse()
+    self.assertEqual(g.labels, ['a', 'b', 'c'])
+    self.assertEqual(g.to_labels(g.neighbors(g.vertex_index['c'])), ['a', 'b'])
+    self.assertEqual(g.edge_weights(g.vertex_index['c']).tolist(), [2, 3])
+    self.assertEqual(g.neighbors(g.vertex_index['a']).tolist(), [])
+  def test_in_edges(self):
+    g = CSRGraph.from_dict({
+      0: [2, 1],
+      1: [2],
+      2: [0],
+    })
+    in_indptr, sources, edge_ids = g.in_edges()
+    self.assertEqual(in_indptr.tolist(), [0, 1, 2, 4])
+    self.assertEqual(sources.tolist(), [2, 0, 0, 1])
+    self.assertEqual(edge_ids.tolist(), [3, 1, 0, 2])
+    self.assertIs(g.in_edges(), g.in_edges())
+  def test_from_edge_list(self):
+    fd, path = tempfile.mkstemp()
+    try:
+      with os.fdopen(fd, 'w') as fh:
+        fh.write('# source target weight\n10 2 1.5\n2 7 2\n10 7 4\n')
+      g = CSRGraph.from_edge_list(path)
+    finally:
+      os.remove(path)
+    self.assertEqual(g.labels.tolist(), [2, 7, 10])
+    self.assertIsInstance(g.vertex_index, SortedVertexIndex)
+    self.assertEqual(g.to_labels(g.neighbors(g.vertex_index[10])), [2, 7])
+    self.assertEqual(g.edge_weights(g.vertex_index[10]).tolist(), [1.5, 4])
+    self.assertNotIn(3, g.vertex_index)
+    self.assertIsNone(g.vertex_index.get('x'))
+  def test_from_edge_list_identity_labels(self):
+    fd, path = tempfile.mkstemp()
+    try:
+      with os.fdopen(fd, 'w') as fh:
+        fh.write('0 2\n2 1\n')
+      g = CSRGraph.from_edge_list(path)
+    finally:
+      os.remove(path)
+    self.assertEqual(list(g.labels), [0, 1, 2])
+    self.assertEqual(g.vertex_index[2], 2)
+    self.assertNotIn(3, g.vertex_index)
+    self.assertNotIn(-1, g.vertex_index)
+    self.assertRaises(KeyError, lambda: g.vertex_index['a'])
+    self.assertEqual(g.to_labels(g.neighbors(0)), [2])
+  def test_from_edge_list_string_vertices(self):
+    fd, path = tempfile.mkstemp()
+    try:
+      with os.fdopen(fd, 'w') as fh:
+        fh.write('b a\nc b\n')
+      g = CSRGraph.from_edge_list(path, vertex_type=str)
+    finally:
+      os.remove(path)
+    self.assertEqual(g.to_labels(range(3)), ['a', 'b', 'c'])
+    self.assertEqual(g.label(g.vertex_index['c']), 'c')
+  def test_identity_labels(self):
+    g = CSRGraph.from_edges([0, 1], [1, 2])
+    self.assertEqual(g.label(2), 2)
+    self.assertEqual(g.to_labels(g.neighbors(1)), [2])
+    self.assertIs(g.reverse().vertex_index, g.vertex_index)
@@ -1,3 +1,13 @@
+import numpy as np
+
+from csr import CSRGraph
+
+
+# Event kinds yielded by dfs_events.
+PREORDER = 'pre'
+POSTORDER = 'post'
+
+
 def dfs(graph, source):
   """
   Given a directed graph (format described below), and a source vertex,
@@ -5,16 +15,76 @@ def dfs(graph, source):
   The graph parameter is expected to be a dictionary mapping each vertex to a
   list of vertices indicating outgoing edges. For example if vertex v has
   outgoing edges to u and w we have graph[v] = [u, w].
+  The graph may also be given as a CSRGraph, in which case source and the
+  returned vertices use the graph's original vertex labels.
+  """
+  if isinstance(graph, CSRGraph):
+    return _dfs_csr(graph, source)
+  return {v for event, v in dfs_events(graph, source) if event == PREORDER}
+
+
+def dfs_events(graph, source):
+  """
+  Given a graph in either format accepted by dfs, and a source vertex, walks
+  the vertices reachable from source depth-first, following each vertex's
+  outgoing edges in order, and yields (PREORDER, v) when v is first reached
+  and (POSTORDER, v) once every edge out of v has been explored.
+  The search keeps its own stack instead of recursing, so its depth is not
+  bounded by the interpreter's recursion limit, and it only advances as the
+  caller consumes events: breaking out of the loop stops the search.
   """
-  visited = set()
-  def _recurse(v):
-    if v in visited:
-      return
-    visited.add(v)
-    for w in graph[v]:
-      _recurse(w)
-  _recurse(source)
-  return visited
+  if isinstance(graph, CSRGraph):
+    for event, v in _dfs_events_csr(graph, graph.vertex_index[source]):
+      yield event, graph.label(v)
+    return
+  visited = {source}
+  yield PREORDER, source
+  # Each stack entry pairs a vertex with the iterator over its remaining
+  # outgoing edges, which is where a recursive version would resume.
+  stack = [(source, iter(graph[source]))]
+  while stack:
+    v, edges = stack[-1]
+    for w in edges:
+      if w not in visited:
+        visited.add(w)
+        yield PREORDER, w
+        stack.append((w, iter(graph[w])))
+        break
+    else:
+      stack.pop()
+      yield POSTORDER, v
+
+
+def _dfs_events_csr(graph, source):
+  indptr, indices = graph.indptr, graph.indices
+  visited = np.zeros(graph.num_vertices, dtype=bool)
+  visited[source] = True
+  yield PREORDER, source
+  stack = [(source, iter(indices[indptr[source]:indptr[source + 1]].tolist()))]
+  while stack:
+    v, edges = stack[-1]
+    for w in edges:
+      if not visited[w]:
+        visited[w] = True
+        yield PREORDER, w
+        stack.append((w, iter(indices[indptr[w]:indptr[w + 1]].tolist())))
+        break
+    else:
+      stack.pop()
+      yield POSTORDER, v
+
+
+def _dfs_csr(graph, source):
+  indptr, indices = graph.indptr, graph.indices
+  visited = np.zeros(graph.num_vertices, dtype=bool)
+  stack = [graph.vertex_index[source]]
+  while stack:
+    v = stack.pop()
+    if visited[v]:
+      continue
+    visited[v] = True
+    stack.extend(indices[indptr[v]:indptr[v + 1]].tolist())
+  return set(graph.to_labels(np.flatnonzero(visited)))
   
   
 #And the accompanied unit test:
@@ -58,3 +128,73 @@ class DFSTest(unittest.TestCase):
     }
     for v in range(5):
       self.assertEqual(dfs(graph, v), {0, 1, 2, 3, 4})
+
+
+class DFSCSRTest(unittest.TestCase):
+  def test_single_vertex_with_loop(self):
+    graph = CSRGraph.from_dict({0: [0]})
+    self.assertEqual(dfs(graph, 0), {0})
+  def test_two_vertices_with_simple_path(self):
+    graph = CSRGraph.from_dict({
+      0: [1],
+      1: [],
+    })
+    self.assertEqual(dfs(graph, 0), {0, 1})
+    self.assertEqual(dfs(graph, 1), {1})
+  def test_labelled_vertices(self):
+    graph = CSRGraph.from_dict({
+      'a': ['b'],
+      'b': ['c'],
+      'c': [],
+      'd': ['a'],
+    })
+    self.assertEqual(dfs(graph, 'a'), {'a', 'b', 'c'})
+  def test_cycle_5(self):
+    graph = CSRGraph.from_dict({
+      0: [1],
+      1: [2],
+      2: [3],
+      3: [4],
+      4: [0],
+    })
+    for v in range(5):
+      self.assertEqual(dfs(graph, v), {0, 1, 2, 3, 4})
+
+
+class DFSEventsTest(unittest.TestCase):
+  def setUp(self):
+    # 0 -> 1 -> 3
+    #  \-> 2 -/
+    self.graph = {
+      0: [1, 2],
+      1: [3],
+      2: [3],
+      3: [],
+    }
+    self.expected = [
+      (PREORDER, 0),
+      (PREORDER, 1),
+      (PREORDER, 3),
+      (POSTORDER, 3),
+      (POSTORDER, 1),
+      (PREORDER, 2),
+      (POSTORDER, 2),
+      (POSTORDER, 0),
+    ]
+  def test_event_order(self):
+    self.assertEqual(list(dfs_events(self.graph, 0)), self.expected)
+  def test_event_order_csr(self):
+    graph = CSRGraph.from_dict(self.graph)
+    self.assertEqual(list(dfs_events(graph, 0)), self.expected)
+  def test_stop_early(self):
+    events = dfs_events(self.graph, 0)
+    self.assertEqual(next(events), (PREORDER, 0))
+    self.assertEqual(next(events), (PREORDER, 1))
+  def test_deep_path(self):
+    n = 100000
+    graph = {v: [v + 1] for v in range(n - 1)}
+    graph[n - 1] = []
+    self.assertEqual(len(dfs(graph, 0)), n)
+    postorder = [v for event, v in dfs_events(CSRGraph.from_dict(graph), 0)
+                 if event == POSTORDER]
+    self.assertEqual(postorder, list(range(n - 1, -1, -1)))
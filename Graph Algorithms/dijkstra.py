@@ -1,9 +1,39 @@
-from collections import namedtuple, defaultdict
-from Queue import PriorityQueue
+from collections import namedtuple
+try:
+  from Queue import PriorityQueue
+except ImportError:
+  from queue import PriorityQueue
+
+import numpy as np
+
+from csr import CSRGraph
+from indexed_heap import IndexedHeap
+from paths import construct_path
 Edge = namedtuple('Edge', ['target', 'weight'])
 
+# Priority queue implementations selectable with dijkstra's engine argument.
+# 'queue' is the thread-safe Queue.PriorityQueue, which pushes a new entry
+# for every improved distance; 'heap' is the lock-free IndexedHeap, which
+# lowers a queued vertex's distance in place and so never holds more than
+# one entry per vertex.
+ENGINES = {
+  'queue': PriorityQueue,
+  'heap': IndexedHeap,
+}
+
 
-def dijkstra(graph, source, target):
+def _new_queue(engine, num_vertices=None):
+  """
+  Returns an empty queue of the given engine. Passing num_vertices says the
+  queued vertices are the ids of a CSRGraph with that many vertices, which
+  lets the heap engine index their positions with a flat array.
+  """
+  if engine == 'heap' and num_vertices is not None:
+    return IndexedHeap(num_items=num_vertices)
+  return ENGINES[engine]()
+
+
+def dijkstra(graph, source, target, engine='queue'):
   """
   Given a directed graph (format described below), and source and target
   vertices, returns a shortest path as a list of vertices going from source
@@ -14,8 +44,18 @@ def dijkstra(graph, source, target):
   list of Edge named tuples indicating the vertex's outgoing edges. For
   example if vertex v has outgoing edges to u and w with weights 10 and 20
   respectively, we have graph[v] = [Edge(u, 10), Edge(w, 20)].
+  The graph may also be given as a CSRGraph, in which case source, target and
+  the returned path use the graph's original vertex labels. Edges of an
+  unweighted CSRGraph count as weight 1.
+  The engine parameter names the priority queue to use, one of the keys of
+  ENGINES.
   """
-  q = PriorityQueue()
+  if engine not in ENGINES:
+    raise ValueError('Unknown dijkstra engine %r, expected one of %s'
+                     % (engine, sorted(ENGINES)))
+  if isinstance(graph, CSRGraph):
+    return _dijkstra_csr(graph, source, target, engine)
+  q = ENGINES[engine]()
   q.put((0, source))
   # previous_vertex[v] holds the immediate vertex before v in the shortest
   # path from source to v. This dictionary also acts as our "visited" set
@@ -23,26 +63,241 @@ def dijkstra(graph, source, target):
   previous_vertex = {source: source}
   # Arguably not the best way to represent infinity but it works for the sake
   # of learning the algorithm.
-  shortest_distance = defaultdict(lambda: float('inf'))
+  inf = float('inf')
+  shortest_distance = {source: 0}
+  # The loop runs once per edge, so the queue methods are looked up once.
+  put, get, empty = q.put, q.get, q.empty
+  while not empty():
+    (distance, v) = get()
+    # A queue without decrease-key still holds the entries pushed before v's
+    # distance last improved; they are stale and can be skipped.
+    if distance > shortest_distance[v]:
+      continue
+    if v == target:
+      return (distance, construct_path(previous_vertex, source, target))
+    for w, weight in graph[v]:
+      alt_distance = weight + distance
+      if alt_distance < shortest_distance.get(w, inf):
+        shortest_distance[w] = alt_distance
+        put((alt_distance, w))
+        previous_vertex[w] = v
+  return None
+
+
+def _dijkstra_csr(graph, source, target, engine):
+  source = graph.vertex_index[source]
+  target = graph.vertex_index.get(target)
+  weights = graph.weights
+  if weights is None:
+    weights = np.ones(graph.num_edges)
+  shortest_distance = np.full(graph.num_vertices, np.inf)
+  previous_vertex = np.full(graph.num_vertices, -1, dtype=np.int64)
+  for distance, v in _settle_csr(graph.indptr, graph.indices, weights, source,
+                                 engine, shortest_distance, previous_vertex):
+    if v == target:
+      return (distance,
+          graph.to_labels(construct_path(previous_vertex, source, target)))
+  return None
+
+
+def _settle_csr(indptr, indices, weights, source, engine, shortest_distance,
+                previous_vertex=None):
+  """
+  Runs dijkstra from source over the arrays of a CSRGraph and yields
+  (distance, v) for every reachable vertex v in the order they are settled.
+  shortest_distance must be an array of inf with one entry per vertex, and
+  previous_vertex, if given, an array of -1 of the same length; both are
+  filled in as the search goes. The search only advances as the caller
+  consumes vertices, so breaking out of the loop stops it.
+  """
+  out_edges = _csr_out_edges(indptr, indices, weights)
   shortest_distance[source] = 0
+  if previous_vertex is not None:
+    previous_vertex[source] = source
+  q = _new_queue(engine, len(indptr) - 1)
+  put, get, empty = q.put, q.get, q.empty
+  put((0, source))
+  while not empty():
+    (distance, v) = get()
+    if distance > shortest_distance[v]:
+      continue
+    yield distance, v
+    for w, weight in out_edges(v):
+      alt_distance = weight + distance
+      if alt_distance < shortest_distance[w]:
+        shortest_distance[w] = alt_distance
+        put((alt_distance, w))
+        if previous_vertex is not None:
+          previous_vertex[w] = v
+
+
+def bidirectional_dijkstra(graph, source, target, reverse=None,
+                           engine='queue'):
+  """
+  Same contract as dijkstra, but searches forward from source and backward
+  from target at the same time and stops once the two searches meet, which
+  usually settles far fewer vertices on point-to-point queries.
+  The backward search walks the reversed graph. It is built on every call
+  unless passed in as reverse (see reverse_graph and CSRGraph.reverse), so
+  callers running many queries on one graph should build it once.
+  """
+  if engine not in ENGINES:
+    raise ValueError('Unknown dijkstra engine %r, expected one of %s'
+                     % (engine, sorted(ENGINES)))
+  if isinstance(graph, CSRGraph):
+    source = graph.vertex_index[source]
+    if target not in graph.vertex_index:
+      return None
+    if reverse is None:
+      reverse = graph.reverse()
+    result = _bidirectional_search(_out_edges(graph), _out_edges(reverse),
+                                   source, graph.vertex_index[target], engine)
+    if result is None:
+      return None
+    return (result[0], graph.to_labels(result[1]))
+  if reverse is None:
+    reverse = reverse_graph(graph)
+  if target not in reverse:
+    return None
+  return _bidirectional_search(_out_edges(graph), _out_edges(reverse),
+                               source, target, engine)
+
+
+def _bidirectional_search(forward_edges, backward_edges, source, target,
+                          engine):
+  if source == target:
+    return (0, [])
+  inf = float('inf')
+  edges = (forward_edges, backward_edges)
+  queues = (ENGINES[engine](), ENGINES[engine]())
+  queues[0].put((0, source))
+  queues[1].put((0, target))
+  shortest_distance = ({source: 0}, {target: 0})
+  # previous_vertex[0][v] is the vertex before v on the best known path from
+  # source, previous_vertex[1][v] the vertex after v on the best known path
+  # to target.
+  previous_vertex = ({source: source}, {target: target})
+  # Distance of the vertex each search settled last. Both only grow, so once
+  # their sum reaches the best path seen so far no shorter path can appear.
+  last_settled = [0, 0]
+  best_distance, meeting_vertex = inf, None
+  side = 1
+  while not queues[0].empty() and not queues[1].empty():
+    side = 1 - side
+    (distance, v) = queues[side].get()
+    if distance > shortest_distance[side][v]:
+      continue
+    last_settled[side] = distance
+    if last_settled[0] + last_settled[1] >= best_distance:
+      break
+    this_distance, other_distance = (shortest_distance[side],
+                                     shortest_distance[1 - side])
+    for w, weight in edges[side](v):
+      alt_distance = distance + weight
+      if alt_distance < this_distance.get(w, inf):
+        this_distance[w] = alt_distance
+        previous_vertex[side][w] = v
+        queues[side].put((alt_distance, w))
+        if w in other_distance:
+          total = alt_distance + other_distance[w]
+          if total < best_distance:
+            best_distance, meeting_vertex = total, w
+  if meeting_vertex is None:
+    return None
+  path = construct_path(previous_vertex[0], source, meeting_vertex)
+  v = meeting_vertex
+  while v != target:
+    v = previous_vertex[1][v]
+    path.append(v)
+  return (best_distance, path)
+
+
+def astar(graph, source, target, heuristic, engine='queue'):
+  """
+  Same contract as dijkstra, but vertices are explored in order of their
+  distance from source plus heuristic(v), an estimate of the remaining
+  distance from v to target. The heuristic must never overestimate that
+  distance for the returned path to be a shortest one; with heuristic
+  returning 0 this is exactly dijkstra. On a CSRGraph the heuristic is
+  called with the original vertex labels.
+  """
+  if engine not in ENGINES:
+    raise ValueError('Unknown dijkstra engine %r, expected one of %s'
+                     % (engine, sorted(ENGINES)))
+  if isinstance(graph, CSRGraph):
+    label = graph.label
+    source = graph.vertex_index[source]
+    if target not in graph.vertex_index:
+      return None
+    result = _astar_search(_out_edges(graph), source,
+                           graph.vertex_index[target],
+                           lambda v: heuristic(label(v)), engine)
+    if result is None:
+      return None
+    return (result[0], graph.to_labels(result[1]))
+  return _astar_search(_out_edges(graph), source, target, heuristic, engine)
+
+
+def _astar_search(out_edges, source, target, heuristic, engine):
+  inf = float('inf')
+  estimate = {source: heuristic(source)}
+  q = ENGINES[engine]()
+  q.put((estimate[source], source))
+  previous_vertex = {source: source}
+  shortest_distance = {source: 0}
   while not q.empty():
-    (distance, v) = q.get()
+    (priority, v) = q.get()
+    distance = shortest_distance[v]
+    if priority > distance + estimate[v]:
+      continue
     if v == target:
-      return (distance, _construct_path(previous_vertex, source, target))
-    for edge in graph[v]:
-      alt_distance = edge.weight + distance
-      if alt_distance < shortest_distance[edge.target]:
-        shortest_distance[edge.target] = alt_distance
-        q.put((alt_distance, edge.target))
-        previous_vertex[edge.target] = v
+      return (distance, construct_path(previous_vertex, source, target))
+    for w, weight in out_edges(v):
+      alt_distance = distance + weight
+      if alt_distance < shortest_distance.get(w, inf):
+        shortest_distance[w] = alt_distance
+        previous_vertex[w] = v
+        if w not in estimate:
+          estimate[w] = heuristic(w)
+        q.put((alt_distance + estimate[w], w))
   return None
 
 
-def _construct_path(previous_vertex, source, target):
-  if source == target:
-    return []
-  return _construct_path(previous_vertex, source,
-               previous_vertex[target]) + [target]
+def reverse_graph(graph):
+  """
+  Given a graph in the dictionary format described in dijkstra, returns the
+  graph with every edge reversed, in the same format.
+  """
+  reverse = {v: [] for v in graph}
+  for v, edges in graph.items():
+    for edge in edges:
+      reverse.setdefault(edge.target, []).append(Edge(v, edge.weight))
+  return reverse
+
+
+def _out_edges(graph):
+  """
+  Returns a function mapping a vertex to an iterable of (target, weight)
+  pairs, for either graph format. CSRGraph vertices are integer ids.
+  """
+  if not isinstance(graph, CSRGraph):
+    # Edge named tuples already unpack as (target, weight).
+    return graph.__getitem__
+  weights = graph.weights
+  if weights is None:
+    weights = np.ones(graph.num_edges)
+  return _csr_out_edges(graph.indptr, graph.indices, weights)
+
+
+def _csr_out_edges(indptr, indices, weights):
+  """
+  Returns a function mapping a vertex id to an iterable of (target, weight)
+  pairs, reading the outgoing edges from the arrays of a CSRGraph.
+  """
+  def _edges(v):
+    start, end = indptr[v], indptr[v + 1]
+    return zip(indices[start:end].tolist(), weights[start:end].tolist())
+  return _edges
 
 
 
@@ -106,3 +361,153 @@ class DijkstraTest(unittest.TestCase):
       ['t', 'x'],
       ['y', 'x'],
     ])
+
+
+class DijkstraCSRTest(unittest.TestCase):
+  def test_single_vertex(self):
+    graph = CSRGraph.from_dict({0: []})
+    self.assertEqual(dijkstra(graph, 0, 0), (0, []))
+  def test_two_vertices_no_path(self):
+    graph = CSRGraph.from_dict({
+      0: [Edge(target=1, weight=10)],
+      1: [],
+    })
+    self.assertEqual(dijkstra(graph, 1, 0), None)
+  def test_cycle_3(self):
+    graph = CSRGraph.from_dict({
+      0: [Edge(target=1, weight=10), Edge(target=2, weight=30)],
+      1: [Edge(target=0, weight=10), Edge(target=2, weight=10)],
+      2: [Edge(target=0, weight=30), Edge(target=1, weight=30)],
+    })
+    self.assertEqual(dijkstra(graph, 0, 0), (0, []))
+    self.assertEqual(dijkstra(graph, 0, 2), (20, [1, 2]))
+  def test_clrs_example(self):
+    graph = CSRGraph.from_dict({
+      's': [Edge(target='t', weight=3), Edge(target='y', weight=5)],
+      't': [Edge(target='x', weight=6), Edge(target='y', weight=2)],
+      'y': [Edge(target='t', weight=1), Edge(target='z', weight=6)],
+      'x': [Edge(target='z', weight=2)],
+      'z': [Edge(target='x', weight=7), Edge(target='s', weight=3)],
+    })
+    distance, path = dijkstra(graph, 's', 'z')
+    self.assertEqual(distance, 11)
+    self.assertIn(path, [
+      ['y', 'z'],
+      ['t', 'y', 'x', 'z'],
+    ])
+
+
+class DijkstraEngineTest(unittest.TestCase):
+  def test_unknown_engine(self):
+    self.assertRaises(ValueError, dijkstra, {0: []}, 0, 0, engine='fib')
+  def test_engines_agree(self):
+    graph = {
+      0: [Edge(target=1, weight=7), Edge(target=2, weight=9),
+          Edge(target=5, weight=14)],
+      1: [Edge(target=0, weight=7), Edge(target=2, weight=10),
+          Edge(target=3, weight=15)],
+      2: [Edge(target=0, weight=9), Edge(target=1, weight=10),
+          Edge(target=3, weight=11), Edge(target=5, weight=2)],
+      3: [Edge(target=1, weight=15), Edge(target=2, weight=11),
+          Edge(target=4, weight=6)],
+      4: [Edge(target=3, weight=6), Edge(target=5, weight=9)],
+      5: [Edge(target=0, weight=14), Edge(target=2, weight=2),
+          Edge(target=4, weight=9)],
+      6: [],
+    }
+    csr_graph = CSRGraph.from_dict(graph)
+    for engine in ENGINES:
+      for g in (graph, csr_graph):
+        self.assertEqual(dijkstra(g, 0, 4, engine=engine), (20, [2, 5, 4]))
+        self.assertEqual(dijkstra(g, 0, 3, engine=engine), (20, [2, 3]))
+        self.assertEqual(dijkstra(g, 0, 6, engine=engine), None)
+  def test_engines_agree_on_random_graph(self):
+    rng = np.random.RandomState(0)
+    n, m = 300, 2400
+    sources, targets = rng.randint(0, n, m), rng.randint(0, n, m)
+    weights = rng.randint(1, 100, m).astype(float)
+    csr_graph = CSRGraph.from_edges(sources, targets, weights, num_vertices=n)
+    graph = {v: [] for v in range(n)}
+    for v, w, weight in zip(sources.tolist(), targets.tolist(),
+                            weights.tolist()):
+      graph[v].append(Edge(w, weight))
+    for target in range(0, n, 7):
+      expected = dijkstra(graph, 0, target, engine='queue')
+      for g in (graph, csr_graph):
+        result = dijkstra(g, 0, target, engine='heap')
+        self.assertEqual(result is None, expected is None)
+        if result is None:
+          continue
+        self.assertEqual(result[0], expected[0])
+        # Paths of equal length may differ, so check result is a path of
+        # the reported length.
+        total, u = 0, 0
+        for x in result[1]:
+          total += min(e.weight for e in graph[u] if e.target == x)
+          u = x
+        self.assertEqual((total, u), (result[0], target))
+
+
+class PointToPointTest(unittest.TestCase):
+  def setUp(self):
+    self.graph = {
+      's': [Edge(target='t', weight=3), Edge(target='y', weight=5)],
+      't': [Edge(target='x', weight=6), Edge(target='y', weight=2)],
+      'y': [Edge(target='t', weight=1), Edge(target='z', weight=6)],
+      'x': [Edge(target='z', weight=2)],
+      'z': [Edge(target='x', weight=7), Edge(target='s', weight=3)],
+      'w': [Edge(target='s', weight=1)],
+    }
+  def test_bidirectional_matches_dijkstra(self):
+    for g in (self.graph, CSRGraph.from_dict(self.graph)):
+      for engine in ENGINES:
+        for v in self.graph:
+          for w in self.graph:
+            expected = dijkstra(g, v, w)
+            result = bidirectional_dijkstra(g, v, w, engine=engine)
+            if expected is None:
+              self.assertEqual(result, None)
+              continue
+            self.assertEqual(result[0], expected[0])
+            # Paths of equal length may differ, so check result is a path of
+            # the reported length.
+            total, u = 0, v
+            for x in result[1]:
+              total += min(e.weight for e in self.graph[u] if e.target == x)
+              u = x
+            self.assertEqual(total, result[0])
+            self.assertEqual(u, w)
+  def test_bidirectional_prebuilt_reverse(self):
+    reverse = reverse_graph(self.graph)
+    self.assertEqual(bidirectional_dijkstra(self.graph, 'w', 'x', reverse),
+                     (10, ['s', 't', 'x']))
+  def test_bidirectional_no_path(self):
+    graph = {0: [Edge(target=1, weight=10)], 1: []}
+    self.assertEqual(bidirectional_dijkstra(graph, 1, 0), None)
+    self.assertEqual(bidirectional_dijkstra(graph, 0, 0), (0, []))
+    self.assertEqual(bidirectional_dijkstra(graph, 0, 'missing'), None)
+  def test_astar_zero_heuristic_is_dijkstra(self):
+    for g in (self.graph, CSRGraph.from_dict(self.graph)):
+      for engine in ENGINES:
+        for v in self.graph:
+          for w in self.graph:
+            result = astar(g, v, w, lambda u: 0, engine=engine)
+            expected = dijkstra(g, v, w)
+            self.assertEqual(result is None, expected is None)
+            if result is not None:
+              self.assertEqual(result[0], expected[0])
+  def test_astar_on_grid(self):
+    # 5x5 grid with unit edges between horizontal and vertical neighbours,
+    # guided by the Manhattan distance to the corner.
+    graph = {}
+    for x in range(5):
+      for y in range(5):
+        graph[(x, y)] = [Edge(target=(x + dx, y + dy), weight=1)
+                         for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))
+                         if 0 <= x + dx < 5 and 0 <= y + dy < 5]
+    manhattan = lambda v: (4 - v[0]) + (4 - v[1])
+    distance, path = astar(graph, (0, 0), (4, 4), manhattan)
+    self.assertEqual(distance, 8)
+    self.assertEqual(len(path), 8)
+    self.assertEqual(path[-1], (4, 4))
+    self.assertEqual(astar(graph, (0, 0), (0, 0), manhattan), (0, []))
@@ -0,0 +1,165 @@
+import numbers
+
+
+class IndexedHeap(object):
+  """
+  A d-ary min-heap of (priority, item) pairs where each item appears at most
+  once. It mirrors the put/get/empty interface of Queue.PriorityQueue, but
+  putting an item that is already queued lowers its priority in place
+  (decrease-key) instead of adding a duplicate entry, so the heap never holds
+  more entries than distinct items. It takes no locks and is not meant to be
+  shared between threads.
+  Items can be any hashable value, with their heap positions kept in a
+  dictionary. When num_items is given, items must be the integers 0 to
+  num_items - 1, and the positions are kept in a flat list indexed by item
+  instead.
+  """
+  def __init__(self, d=4, num_items=None):
+    if d < 2:
+      raise ValueError('Heap arity must be at least 2, got %r' % (d,))
+    self.d = d
+    self.num_items = num_items
+    # The priorities and items of the heap entries, kept in two parallel
+    # lists so sifting compares plain numbers instead of tuples.
+    self.keys = []
+    self.items = []
+    # position[item] is the index of item's entry in the heap, or -1 if the
+    # item is not queued.
+    if num_items is None:
+      self.position = {}
+    else:
+      # A list reads and writes single elements several times faster than a
+      # NumPy array, and takes the same 8 bytes per slot.
+      self.position = [-1] * num_items
+
+  def __len__(self):
+    return len(self.keys)
+
+  def __contains__(self, item):
+    if self.num_items is None:
+      return self.position.get(item, -1) >= 0
+    return (isinstance(item, numbers.Integral) and 0 <= item < self.num_items
+            and self.position[item] >= 0)
+
+  def empty(self):
+    return not self.keys
+
+  def put(self, entry):
+    """
+    Queues a (priority, item) pair. If item is already queued its priority
+    is lowered to the new one; a higher priority is ignored.
+    """
+    priority, item = entry
+    keys, items, position = self.keys, self.items, self.position
+    if self.num_items is None:
+      i = position.get(item, -1)
+    else:
+      i = position[item]
+    if i < 0:
+      i = len(keys)
+      keys.append(priority)
+      items.append(item)
+    elif priority >= keys[i]:
+      return
+    # Sift up, inlined since put runs once per relaxed edge.
+    d = self.d
+    while i > 0:
+      parent = (i - 1) // d
+      parent_key = keys[parent]
+      if parent_key <= priority:
+        break
+      keys[i] = parent_key
+      items[i] = moved = items[parent]
+      position[moved] = i
+      i = parent
+    keys[i] = priority
+    items[i] = item
+    position[item] = i
+
+  def get(self):
+    """Removes and returns the (priority, item) pair with lowest priority."""
+    keys, items = self.keys, self.items
+    top = (keys[0], items[0])
+    self.position[top[1]] = -1
+    key, item = keys.pop(), items.pop()
+    if keys:
+      self._sift_down(0, key, item)
+    return top
+
+  def _sift_down(self, i, key, item):
+    keys, items, position, d = self.keys, self.items, self.position, self.d
+    n = len(keys)
+    first = d * i + 1
+    while first < n:
+      last = first + d
+      # min and index scan the children in C rather than in a Python loop.
+      child_key = min(keys[first:last])
+      if child_key >= key:
+        break
+      child = keys.index(child_key, first, last)
+      keys[i] = child_key
+      items[i] = moved = items[child]
+      position[moved] = i
+      i = child
+      first = d * i + 1
+    keys[i] = key
+    items[i] = item
+    position[item] = i
+
+
+
+import random
+import unittest
+
+class IndexedHeapTest(unittest.TestCase):
+  def test_empty(self):
+    h = IndexedHeap()
+    self.assertTrue(h.empty())
+    self.assertEqual(len(h), 0)
+  def test_invalid_arity(self):
+    self.assertRaises(ValueError, IndexedHeap, 1)
+  def test_get_in_priority_order(self):
+    for d in range(2, 6):
+      for h in (IndexedHeap(d), IndexedHeap(d, num_items=50)):
+        priorities = list(range(50))
+        random.Random(d).shuffle(priorities)
+        for p in priorities:
+          h.put((p, p))
+        self.assertEqual([h.get()[0] for _ in range(50)], list(range(50)))
+        self.assertTrue(h.empty())
+  def test_decrease_key(self):
+    h = IndexedHeap()
+    h.put((10, 'a'))
+    h.put((20, 'b'))
+    h.put((5, 'b'))
+    self.assertEqual(len(h), 2)
+    self.assertEqual(h.get(), (5, 'b'))
+    self.assertEqual(h.get(), (10, 'a'))
+    self.assertTrue(h.empty())
+  def test_higher_priority_is_ignored(self):
+    h = IndexedHeap()
+    h.put((10, 'a'))
+    h.put((30, 'a'))
+    self.assertEqual(len(h), 1)
+    self.assertEqual(h.get(), (10, 'a'))
+  def test_contains(self):
+    for h in (IndexedHeap(), IndexedHeap(num_items=3)):
+      h.put((1, 2))
+      self.assertIn(2, h)
+      self.assertNotIn(0, h)
+      self.assertNotIn('a', h)
+      h.get()
+      self.assertNotIn(2, h)
+      h.put((2, 2))
+      self.assertIn(2, h)
+  def test_size_never_exceeds_distinct_items(self):
+    rng = random.Random(0)
+    for h in (IndexedHeap(3), IndexedHeap(3, num_items=20)):
+      best = {}
+      for _ in range(1000):
+        item, priority = rng.randrange(20), rng.random()
+        h.put((priority, item))
+        best[item] = min(priority, best.get(item, priority))
+        self.assertEqual(len(h), len(best))
+      result = [h.get() for _ in range(len(best))]
+      self.assertEqual(result, sorted((p, v) for v, p in best.items()))
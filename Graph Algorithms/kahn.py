@@ -1,6 +1,13 @@
 from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from csr import CSRGraph
 Vertex = namedtuple('Vertex', ['name', 'incoming', 'outgoing'])
 
+EXECUTORS = {'thread': ThreadPoolExecutor, 'process': ProcessPoolExecutor}
+
 
 def build_doubly_linked_graph(graph):
   """
@@ -10,12 +17,12 @@ def build_doubly_linked_graph(graph):
   """
   g = {v:Vertex(name=v, incoming=set(), outgoing=set(o))
      for v, o in graph.items()}
-  for v in g.values():
+  for v in list(g.values()):
     for w in v.outgoing:
       if w in g:
         g[w].incoming.add(v.name)
       else:
-        g[w] = Vertex(name=w, incoming={v}, outgoing=set())
+        g[w] = Vertex(name=w, incoming={v.name}, outgoing=set())
   return g
 
 
@@ -28,7 +35,11 @@ def kahn_top_sort(graph):
   The graph parameter is expected to be a dictionary mapping each vertex to a
   list of vertices indicating outgoing edges. For example if vertex v has
   outgoing edges to u and w we have graph[v] = [u, w].
+  The graph may also be given as a CSRGraph, in which case the returned
+  dictionary is keyed by the graph's original vertex labels.
   """
+  if isinstance(graph, CSRGraph):
+    return _kahn_top_sort_csr(graph)
   g = build_doubly_linked_graph(graph)
   # sequence[v] < sequence[w] implies v should be before w in the topological
   # sort.
@@ -44,7 +55,225 @@ def kahn_top_sort(graph):
   return sequence
 
 
+def _kahn_top_sort_csr(graph):
+  indptr, indices = graph.indptr, graph.indices
+  # A CSRGraph has no incoming edge lists, but Kahn's algorithm only needs
+  # to know how many incoming edges are left, which bincount gives us in one
+  # pass over the edge array.
+  remaining = np.bincount(indices, minlength=graph.num_vertices)
+  sequence = np.full(graph.num_vertices, -1, dtype=np.int64)
+  sources = np.flatnonzero(remaining == 0)
+  sequence[sources] = 0
+  q = deque(sources.tolist())
+  while q:
+    v = q.popleft()
+    for w in indices[indptr[v]:indptr[v + 1]].tolist():
+      remaining[w] -= 1
+      if not remaining[w]:
+        sequence[w] = sequence[v] + 1
+        q.append(w)
+  return {label: s
+          for label, s in zip(graph.to_labels(range(len(sequence))),
+                              sequence.tolist()) if s >= 0}
+
+
+def kahn_levels(graph):
+  """
+  Given an acyclic directed graph in either format accepted by kahn_top_sort,
+  returns (levels, critical_path_length). levels is a list of lists of
+  vertices where levels[i] holds the vertices with sequence i: every vertex
+  only has incoming edges from earlier levels, so the vertices of one level
+  can be processed in parallel once all earlier levels are done.
+  critical_path_length is the number of vertices on a longest path, which
+  is also the number of levels. Raises ValueError if the graph has a cycle.
+  """
+  sequence = kahn_top_sort(graph)
+  # Kahn's algorithm never reaches the vertices on a cycle, or anything
+  # downstream of one, so they are missing from the sequence.
+  if isinstance(graph, CSRGraph):
+    num_vertices = graph.num_vertices
+  else:
+    num_vertices = len(set(graph).union(*graph.values()))
+  if len(sequence) != num_vertices:
+    raise ValueError('Graph has a cycle')
+  levels = []
+  for v, s in sequence.items():
+    while len(levels) <= s:
+      levels.append([])
+    levels[s].append(v)
+  return levels, len(levels)
+
+
+def run_levels(graph, task, workers=None, executor='thread'):
+  """
+  Given an acyclic directed graph in either format accepted by kahn_top_sort
+  and a callable task, calls task(v) for every vertex and returns a
+  dictionary mapping vertex to the result. Vertices are dispatched one level
+  of kahn_levels at a time to a pool with the given number of workers, so
+  task(v) only starts after task has finished for every vertex with an edge
+  to v. executor is 'thread' or 'process'; with 'process', task and the
+  vertices must be picklable. An exception raised by task is raised here
+  once its level has finished, and later levels are not started. Raises
+  ValueError without calling task if the graph has a cycle.
+  """
+  if executor not in EXECUTORS:
+    raise ValueError('Unknown executor %r, expected one of %s'
+                     % (executor, sorted(EXECUTORS)))
+  levels, _ = kahn_levels(graph)
+  results = {}
+  with EXECUTORS[executor](workers) as pool:
+    for level in levels:
+      futures = [pool.submit(task, v) for v in level]
+      for v, future in zip(level, futures):
+        results[v] = future.result()
+  return results
+
+
+class DynamicTopoOrder(object):
+  """
+  Keeps a topological order of a DAG up to date while edges are added and
+  removed, using the Pearce-Kelly algorithm: inserting an edge v -> w only
+  reorders the vertices whose position lies between w and v, found by a
+  forward search from w and a backward search from v, instead of sorting
+  the whole graph again. The initial graph is given in either format
+  accepted by kahn_top_sort (or omitted for an empty graph) and must be
+  acyclic.
+  """
+  def __init__(self, graph=None):
+    self.successors = {}
+    self.predecessors = {}
+    # position[v] is v's index in the order, vertex_at the inverse.
+    self.position = {}
+    self.vertex_at = []
+    if graph is None:
+      return
+    if isinstance(graph, CSRGraph):
+      edges = {graph.label(v): graph.to_labels(graph.neighbors(v))
+               for v in range(graph.num_vertices)}
+    else:
+      edges = graph
+    for v, outgoing in edges.items():
+      self.add_vertex(v)
+      for w in outgoing:
+        self.add_vertex(w)
+        self.successors[v].add(w)
+        self.predecessors[w].add(v)
+    # Kahn's algorithm over the sets just built gives the initial order.
+    remaining = {v: len(p) for v, p in self.predecessors.items()}
+    order = [v for v in self.vertex_at if not remaining[v]]
+    for v in order:
+      for w in self.successors[v]:
+        remaining[w] -= 1
+        if not remaining[w]:
+          order.append(w)
+    if len(order) != len(self.vertex_at):
+      raise ValueError('Initial graph has a cycle')
+    self.vertex_at = order
+    for i, v in enumerate(order):
+      self.position[v] = i
+
+  def __len__(self):
+    return len(self.vertex_at)
+
+  def __contains__(self, v):
+    return v in self.position
+
+  def order(self):
+    """Returns the vertices as a list in topological order."""
+    return list(self.vertex_at)
+
+  def add_vertex(self, v):
+    """Adds v, with no edges, at the end of the order if not already present."""
+    if v not in self.position:
+      self.position[v] = len(self.vertex_at)
+      self.vertex_at.append(v)
+      self.successors[v] = set()
+      self.predecessors[v] = set()
+
+  def add_edge(self, v, w):
+    """
+    Adds the edge v -> w, adding either vertex if needed, and updates the
+    order. Returns None if the graph is still acyclic. If the edge would
+    close a cycle it is not added, and the cycle is returned instead as a
+    list of vertices [w, ..., v] joined by existing edges, which the new
+    edge would have closed.
+    """
+    self.add_vertex(v)
+    self.add_vertex(w)
+    if w in self.successors[v]:
+      return None
+    if v == w:
+      return [v]
+    lower, upper = self.position[w], self.position[v]
+    if lower < upper:
+      forward = self._forward_search(w, v, upper)
+      if isinstance(forward, list):
+        return forward
+      backward = self._backward_search(v, lower)
+      self._reorder(backward, forward)
+    self.successors[v].add(w)
+    self.predecessors[w].add(v)
+    return None
+
+  def remove_edge(self, v, w):
+    """
+    Removes the edge v -> w, raising KeyError if there is no such edge.
+    Removing an edge never invalidates a topological order, so the order is
+    left as it is.
+    """
+    self.successors[v].remove(w)
+    self.predecessors[w].remove(v)
+
+  def _forward_search(self, w, v, upper):
+    # Vertices reachable from w that sit no later than v in the order. If v
+    # is among them, the path from w to v is returned as the cycle.
+    position = self.position
+    parent = {w: None}
+    stack = [w]
+    while stack:
+      u = stack.pop()
+      for x in self.successors[u]:
+        if x == v:
+          cycle = [v, u]
+          while parent[u] is not None:
+            u = parent[u]
+            cycle.append(u)
+          cycle.reverse()
+          return cycle
+        if x not in parent and position[x] < upper:
+          parent[x] = u
+          stack.append(x)
+    return parent
+
+  def _backward_search(self, v, lower):
+    # Vertices that reach v and sit after w in the order.
+    position = self.position
+    seen = {v}
+    stack = [v]
+    while stack:
+      u = stack.pop()
+      for x in self.predecessors[u]:
+        if x not in seen and position[x] > lower:
+          seen.add(x)
+          stack.append(x)
+    return seen
+
+  def _reorder(self, backward, forward):
+    # The affected vertices keep the same set of positions, handed out so
+    # that everything reaching v comes before everything reachable from w,
+    # each group keeping its current relative order.
+    position = self.position
+    backward = sorted(backward, key=position.get)
+    forward = sorted(forward, key=position.get)
+    slots = sorted(position[u] for u in backward + forward)
+    for u, i in zip(backward + forward, slots):
+      position[u] = i
+      self.vertex_at[i] = u
+
+
 #And the accompanied unit test:
+import random
+import threading
 import unittest
 
 class KahnTopSortTest(unittest.TestCase):
@@ -110,3 +339,166 @@ class KahnTopSortTest(unittest.TestCase):
       1: 2,
       2: 3,
     })
+
+
+class KahnTopSortCSRTest(unittest.TestCase):
+  def test_single_vertex(self):
+    graph = CSRGraph.from_dict({0: []})
+    self.assertEqual(kahn_top_sort(graph), {0: 0})
+  def test_two_independent_total_orders(self):
+    graph = CSRGraph.from_dict({
+      0: [1],
+      1: [2],
+      2: [],
+      3: [4],
+      4: [5],
+      5: [],
+    })
+    self.assertEqual(kahn_top_sort(graph), {
+      0: 0,
+      3: 0,
+      1: 1,
+      4: 1,
+      2: 2,
+      5: 2,
+    })
+  def test_simple_dag_1(self):
+    graph = CSRGraph.from_dict({
+      'a': ['b', 'd'],
+      'b': ['c'],
+      'c': [],
+      'd': ['b'],
+    })
+    self.assertEqual(kahn_top_sort(graph), {
+      'a': 0,
+      'd': 1,
+      'b': 2,
+      'c': 3,
+    })
+
+
+class KahnLevelsTest(unittest.TestCase):
+  def test_simple_dag_1(self):
+    graph = {
+      0: [1, 3],
+      1: [2],
+      2: [],
+      3: [1],
+    }
+    self.assertEqual(kahn_levels(graph), ([[0], [3], [1], [2]], 4))
+  def test_csr_levels(self):
+    graph = CSRGraph.from_dict({
+      'a': ['c'],
+      'b': ['c'],
+      'c': [],
+    })
+    levels, length = kahn_levels(graph)
+    self.assertEqual([sorted(level) for level in levels], [['a', 'b'], ['c']])
+    self.assertEqual(length, 2)
+  def test_empty_graph(self):
+    self.assertEqual(kahn_levels({}), ([], 0))
+  def test_target_only_vertices(self):
+    self.assertEqual(kahn_levels({0: [1, 2]}), ([[0], [1, 2]], 2))
+  def test_cycle(self):
+    graph = {0: [1], 1: [2], 2: [1], 3: []}
+    self.assertRaises(ValueError, kahn_levels, graph)
+    self.assertRaises(ValueError, kahn_levels, CSRGraph.from_dict(graph))
+
+class RunLevelsTest(unittest.TestCase):
+  graph = {
+    0: [1, 2],
+    1: [3],
+    2: [3],
+    3: [],
+    4: [3],
+  }
+  def test_dependencies_finish_first(self):
+    finished = []
+    lock = threading.Lock()
+    def task(v):
+      with lock:
+        finished.append(v)
+      return v * 10
+    results = run_levels(self.graph, task, workers=3)
+    self.assertEqual(results, {0: 0, 1: 10, 2: 20, 3: 30, 4: 40})
+    position = {v: i for i, v in enumerate(finished)}
+    for v, outgoing in self.graph.items():
+      for w in outgoing:
+        self.assertLess(position[v], position[w])
+  def test_process_pool(self):
+    results = run_levels(self.graph, str, workers=2, executor='process')
+    self.assertEqual(results, {v: str(v) for v in self.graph})
+  def test_task_error(self):
+    def task(v):
+      if v == 1:
+        raise RuntimeError(v)
+    self.assertRaises(RuntimeError, run_levels, self.graph, task)
+  def test_unknown_executor(self):
+    self.assertRaises(ValueError, run_levels, self.graph, str,
+                      executor='fiber')
+  def test_cycle(self):
+    called = []
+    self.assertRaises(ValueError, run_levels,
+                      {0: [1], 1: [2], 2: [1], 3: []}, called.append)
+    self.assertEqual(called, [])
+
+
+class DynamicTopoOrderTest(unittest.TestCase):
+  def assertTopological(self, d):
+    position = {v: i for i, v in enumerate(d.order())}
+    for v, outgoing in d.successors.items():
+      for w in outgoing:
+        self.assertLess(position[v], position[w])
+  def test_initial_graph(self):
+    d = DynamicTopoOrder({
+      0: [1, 3],
+      1: [2],
+      2: [],
+      3: [1],
+    })
+    self.assertEqual(d.order(), [0, 3, 1, 2])
+  def test_initial_csr_graph(self):
+    d = DynamicTopoOrder(CSRGraph.from_dict({'a': ['b'], 'c': ['a']}))
+    self.assertEqual(d.order(), ['c', 'a', 'b'])
+  def test_initial_cycle(self):
+    self.assertRaises(ValueError, DynamicTopoOrder, {0: [1], 1: [0]})
+  def test_add_edge_reorders(self):
+    d = DynamicTopoOrder()
+    for v in 'abcd':
+      d.add_vertex(v)
+    self.assertIsNone(d.add_edge('c', 'b'))
+    self.assertIsNone(d.add_edge('d', 'a'))
+    self.assertIsNone(d.add_edge('b', 'd'))
+    self.assertEqual(d.order(), ['c', 'b', 'd', 'a'])
+    self.assertEqual(len(d), 4)
+  def test_add_edge_adds_vertices(self):
+    d = DynamicTopoOrder()
+    d.add_edge(1, 0)
+    self.assertIn(0, d)
+    self.assertEqual(d.order(), [1, 0])
+  def test_cycle_is_reported(self):
+    d = DynamicTopoOrder({0: [1], 1: [2], 2: [3], 3: []})
+    self.assertEqual(d.add_edge(3, 1), [1, 2, 3])
+    self.assertEqual(d.add_edge(2, 2), [2])
+    self.assertNotIn(1, d.successors[3])
+    self.assertEqual(d.order(), [0, 1, 2, 3])
+  def test_remove_edge_allows_reversal(self):
+    d = DynamicTopoOrder({0: [1], 1: []})
+    self.assertIsNotNone(d.add_edge(1, 0))
+    d.remove_edge(0, 1)
+    self.assertIsNone(d.add_edge(1, 0))
+    self.assertEqual(d.order(), [1, 0])
+    self.assertRaises(KeyError, d.remove_edge, 0, 1)
+  def test_random_insertions(self):
+    rng = random.Random(0)
+    n = 60
+    d = DynamicTopoOrder({v: [] for v in range(n)})
+    for _ in range(600):
+      v, w = rng.randrange(n), rng.randrange(n)
+      cycle = d.add_edge(v, w)
+      if cycle is not None:
+        # The reported path leads from w back to v.
+        self.assertEqual((cycle[0], cycle[-1]), (w, v))
+        for a, b in zip(cycle, cycle[1:]):
+          self.assertIn(b, d.successors[a])
+      self.assertTopological(d)
@@ -1,4 +1,9 @@
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from shared_arrays import SharedArrays, attach
 from union_find import DisjointSet
 
 
@@ -6,8 +11,16 @@ from union_find import DisjointSet
 # then source and target (lexicographically).
 Edge = namedtuple('Edge', ['weight', 'source', 'target'])
 
+# Structured array layout accepted by kruskal_mst and boruvka_mst in place of
+# a collection of Edge namedtuples, with the same field order.
+EDGE_DTYPE = np.dtype([
+  ('weight', np.float64),
+  ('source', np.int64),
+  ('target', np.int64),
+])
+
 
-def kruskal_mst(n, edges):
+def kruskal_mst(n, edges, presorted=False):
   """
   Given a positive integer n (number of vertices) and a collection of Edge
   namedtuple objects representing the undirected edges of a graph, returns a
@@ -16,7 +29,13 @@ def kruskal_mst(n, edges):
   valid connected undirected graph and that for two vertices v and w only one
   of (v, w) or (w, v) is an edge in the input. Output is undefined if these
   assumptions are not satisfied.
+  edges may also be a NumPy array with dtype EDGE_DTYPE, in which case the
+  tree is returned as an array of the same dtype. It is sorted with a single
+  argsort rather than by comparing tuples, or not at all if presorted says it
+  is already in (weight, source, target) order.
   """
+  if isinstance(edges, np.ndarray):
+    return _kruskal_array(n, edges, presorted)
   d = DisjointSet(n)
   mst_tree = []
   for edge in sorted(edges):
@@ -28,6 +47,143 @@ def kruskal_mst(n, edges):
   return mst_tree
 
 
+def _sort_edges(edges):
+  # lexsort sorts by its last key first, giving the same order as sorting
+  # Edge namedtuples.
+  return edges[np.lexsort((edges['target'], edges['source'],
+                           edges['weight']))]
+
+
+def _kruskal_array(n, edges, presorted, chunk_size=1 << 16):
+  if not presorted:
+    edges = _sort_edges(edges)
+  d = DisjointSet(n)
+  union = d.union
+  chosen = []
+  # Walk the edges a chunk at a time so each chunk's endpoints can be
+  # converted to plain ints in one go.
+  for start in range(0, len(edges), chunk_size):
+    if len(chosen) >= n - 1:
+      break
+    chunk = edges[start:start + chunk_size]
+    for i, (v, w) in enumerate(zip(chunk['source'].tolist(),
+                                   chunk['target'].tolist())):
+      if union(v, w):
+        chosen.append(start + i)
+        if len(chosen) == n - 1:
+          break
+  return edges[np.array(chosen, dtype=np.int64)]
+
+
+def boruvka_mst(n, edges, workers=1, chunk_size=1 << 20):
+  """
+  Same contract as kruskal_mst, computed with Boruvka's algorithm: every
+  round, each component picks its lightest edge to another component and
+  all of those edges are merged at once, so there are at most log2(n)
+  rounds. The lightest-edge search scans the edge array in chunks of
+  chunk_size, spread over a ProcessPoolExecutor when workers is more than 1;
+  the edge and component arrays live in shared memory that every worker
+  maps. Ties are broken as in kruskal_mst, so both return the same tree.
+  """
+  tuples = None
+  if not isinstance(edges, np.ndarray):
+    tuples = sorted(edges)
+    edges = np.array([tuple(e) for e in tuples], dtype=EDGE_DTYPE)
+  else:
+    edges = _sort_edges(edges)
+  # An edge's position in sorted order is its rank, which orders edges
+  # strictly even when weights tie and so keeps the picked edges acyclic.
+  sources = np.ascontiguousarray(edges['source'])
+  targets = np.ascontiguousarray(edges['target'])
+  component = np.arange(n, dtype=np.int64)
+  chunks = [(start, min(start + chunk_size, len(edges)))
+            for start in range(0, len(edges), chunk_size)]
+  d = DisjointSet(n)
+  chosen = []
+  if workers == 1 or len(chunks) <= 1:
+    arrays = (sources, targets, component)
+    while d.num_sets > 1:
+      component[:] = d.find_many(np.arange(n))
+      picked = _merge_lightest(n, len(edges), chunks,
+                               [_lightest_edges(arrays, c) for c in chunks])
+      if not _join(d, sources, targets, picked, chosen):
+        break
+  else:
+    with SharedArrays((sources, targets, component)) as shared:
+      component = shared.arrays[2]
+      with ProcessPoolExecutor(workers, initializer=_attach_edges,
+                               initargs=(shared.specs,)) as executor:
+        while d.num_sets > 1:
+          component[:] = d.find_many(np.arange(n))
+          picked = _merge_lightest(n, len(edges), chunks,
+                                   executor.map(_worker_lightest_edges,
+                                                chunks))
+          if not _join(d, sources, targets, picked, chosen):
+            break
+      del component
+  chosen.sort()
+  if tuples is not None:
+    return [tuples[i] for i in chosen]
+  return edges[np.array(chosen, dtype=np.int64)]
+
+
+def _lightest_edges(arrays, chunk):
+  """
+  Returns (components, ranks) with the lowest-ranked edge of the chunk
+  leaving each component that has one.
+  """
+  sources, targets, component = arrays
+  start, end = chunk
+  cs = component[sources[start:end]]
+  ct = component[targets[start:end]]
+  crossing = np.flatnonzero(cs != ct)
+  ends = np.concatenate((cs[crossing], ct[crossing]))
+  ranks = np.concatenate((crossing, crossing)) + start
+  # Sorting by component, then rank, puts each component's lightest edge
+  # first in its group.
+  order = np.lexsort((ranks, ends))
+  ends, ranks = ends[order], ranks[order]
+  first = _first_of_runs(ends)
+  return ends[first], ranks[first]
+
+
+def _merge_lightest(n, num_edges, chunks, results):
+  best = np.full(n, num_edges, dtype=np.int64)
+  for components, ranks in results:
+    np.minimum.at(best, components, ranks)
+  picked = np.sort(best[best < num_edges])
+  return picked[_first_of_runs(picked)]
+
+
+def _first_of_runs(a):
+  """Marks the first element of every run of equal values in a."""
+  first = np.ones(len(a), dtype=bool)
+  first[1:] = a[1:] != a[:-1]
+  return first
+
+
+def _join(d, sources, targets, picked, chosen):
+  if not len(picked):
+    return False
+  d.union_many(sources[picked], targets[picked])
+  chosen.extend(picked.tolist())
+  return True
+
+
+# Set in each worker process by _attach_edges. The SharedMemory handles are
+# kept alongside the arrays so the mappings stay valid for the worker's life.
+_worker_state = None
+
+
+def _attach_edges(specs):
+  global _worker_state
+  _worker_state = attach(specs)
+
+
+def _worker_lightest_edges(chunk):
+  return _lightest_edges(_worker_state[1], chunk)
+
+
 
 import unittest
 
@@ -66,3 +222,51 @@ class KruskalMSPTest(unittest.TestCase):
       Edge(source=1, target=2, weight=20),
       Edge(source=0, target=3, weight=40),
     ])
+
+
+class MSTArrayTest(unittest.TestCase):
+  def setUp(self):
+    self.edges = [
+      Edge(source=0, target=1, weight=10),
+      Edge(source=0, target=2, weight=30),
+      Edge(source=0, target=3, weight=40),
+      Edge(source=1, target=2, weight=20),
+      Edge(source=1, target=3, weight=50),
+      Edge(source=2, target=3, weight=60),
+    ]
+    self.expected = [
+      Edge(source=0, target=1, weight=10),
+      Edge(source=1, target=2, weight=20),
+      Edge(source=0, target=3, weight=40),
+    ]
+  def test_kruskal_array(self):
+    edges = np.array([tuple(e) for e in self.edges], dtype=EDGE_DTYPE)
+    mst_tree = kruskal_mst(4, edges)
+    self.assertEqual(mst_tree.dtype, EDGE_DTYPE)
+    self.assertEqual(mst_tree.tolist(), [tuple(e) for e in self.expected])
+  def test_kruskal_array_presorted(self):
+    edges = np.array(sorted(tuple(e) for e in self.edges), dtype=EDGE_DTYPE)
+    self.assertEqual(kruskal_mst(4, edges, presorted=True).tolist(),
+                     [tuple(e) for e in self.expected])
+  def test_kruskal_array_single_vertex(self):
+    self.assertEqual(len(kruskal_mst(1, np.zeros(0, dtype=EDGE_DTYPE))), 0)
+  def test_boruvka_tuples(self):
+    self.assertEqual(boruvka_mst(4, self.edges), self.expected)
+    self.assertEqual(boruvka_mst(1, []), [])
+  def test_boruvka_matches_kruskal_with_ties(self):
+    rng = np.random.RandomState(0)
+    n = 60
+    # A spanning path keeps the graph connected; weights from a small range
+    # force plenty of ties.
+    pairs = {(v, v + 1) for v in range(n - 1)}
+    while len(pairs) < 300:
+      v, w = sorted(rng.randint(0, n, size=2).tolist())
+      if v != w:
+        pairs.add((v, w))
+    edges = np.array([(rng.randint(0, 5), v, w) for v, w in sorted(pairs)],
+                     dtype=EDGE_DTYPE)
+    expected = kruskal_mst(n, edges).tolist()
+    self.assertEqual(len(expected), n - 1)
+    self.assertEqual(boruvka_mst(n, edges, chunk_size=64).tolist(), expected)
+    self.assertEqual(
+        boruvka_mst(n, edges, workers=2, chunk_size=64).tolist(), expected)
@@ -0,0 +1,124 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from csr import CSRGraph
+from dijkstra import ENGINES, _settle_csr
+from shared_arrays import SharedArrays, attach
+
+
+def shortest_path_matrix(graph, sources, targets, workers=None,
+                         engine='heap', chunk_size=16):
+  """
+  Given a graph in either format accepted by dijkstra and lists of source and
+  target vertices, returns a len(sources) x len(targets) NumPy array whose
+  [i, j] entry is the shortest distance from sources[i] to targets[j], or
+  inf if there is no such path. Assumes non-negative weights.
+  Each source costs one single-source search, which stops as soon as every
+  target is settled. The sources are split into chunks of chunk_size and run
+  on a ProcessPoolExecutor with the given number of workers (None means one
+  per CPU, 1 runs everything in this process). The graph's arrays are placed
+  in shared memory once and mapped by every worker instead of being pickled
+  along with each task.
+  """
+  if engine not in ENGINES:
+    raise ValueError('Unknown dijkstra engine %r, expected one of %s'
+                     % (engine, sorted(ENGINES)))
+  if not isinstance(graph, CSRGraph):
+    graph = CSRGraph.from_dict(graph)
+  source_ids = np.array([graph.vertex_index[v] for v in sources],
+                        dtype=np.int64)
+  target_ids = np.array([graph.vertex_index[v] for v in targets],
+                        dtype=np.int64)
+  weights = graph.weights
+  if weights is None:
+    weights = np.ones(graph.num_edges)
+  arrays = (graph.indptr, graph.indices, weights, target_ids)
+  chunks = [source_ids[i:i + chunk_size]
+            for i in range(0, len(source_ids), chunk_size)]
+  if workers == 1 or len(chunks) <= 1:
+    return _distance_rows(arrays, source_ids, engine)
+  with SharedArrays(arrays) as shared:
+    with ProcessPoolExecutor(workers, initializer=_attach_graph,
+                             initargs=(shared.specs,)) as executor:
+      rows = executor.map(_worker_distance_rows, chunks,
+                          [engine] * len(chunks))
+      return np.vstack(list(rows))
+
+
+def _distance_rows(arrays, source_ids, engine):
+  indptr, indices, weights, target_ids = arrays
+  rows = np.empty((len(source_ids), len(target_ids)))
+  for i, source in enumerate(source_ids.tolist()):
+    rows[i] = _single_source(indptr, indices, weights, source, target_ids,
+                             engine)[target_ids]
+  return rows
+
+
+def _single_source(indptr, indices, weights, source, target_ids, engine):
+  shortest_distance = np.full(len(indptr) - 1, np.inf)
+  unsettled_targets = set(target_ids.tolist())
+  if not unsettled_targets:
+    return shortest_distance
+  for _, v in _settle_csr(indptr, indices, weights, source, engine,
+                          shortest_distance):
+    unsettled_targets.discard(v)
+    if not unsettled_targets:
+      break
+  return shortest_distance
+
+
+# Set in each worker process by _attach_graph. The SharedMemory handles are
+# kept alongside the arrays so the mappings stay valid for the worker's life.
+_worker_state = None
+
+
+def _attach_graph(specs):
+  global _worker_state
+  _worker_state = attach(specs)
+
+
+def _worker_distance_rows(source_ids, engine):
+  return _distance_rows(_worker_state[1], source_ids, engine)
+
+
+
+import unittest
+from collections import namedtuple
+Edge = namedtuple('Edge', ['target', 'weight'])
+
+class ShortestPathMatrixTest(unittest.TestCase):
+  def setUp(self):
+    self.graph = {
+      's': [Edge(target='t', weight=3), Edge(target='y', weight=5)],
+      't': [Edge(target='x', weight=6), Edge(target='y', weight=2)],
+      'y': [Edge(target='t', weight=1), Edge(target='z', weight=6)],
+      'x': [Edge(target='z', weight=2)],
+      'z': [Edge(target='x', weight=7), Edge(target='s', weight=3)],
+      'w': [Edge(target='s', weight=1)],
+    }
+    self.expected = [
+      [0, 3, 5, 9, 11, np.inf],
+      [11, 0, 2, 6, 8, np.inf],
+      [5, 8, 10, 0, 2, np.inf],
+      [1, 4, 6, 10, 12, 0],
+    ]
+  def test_single_process(self):
+    for engine in ENGINES:
+      matrix = shortest_path_matrix(self.graph, ['s', 't', 'x', 'w'],
+                                    ['s', 't', 'y', 'x', 'z', 'w'],
+                                    workers=1, engine=engine)
+      self.assertEqual(matrix.tolist(), self.expected)
+  def test_worker_pool(self):
+    graph = CSRGraph.from_dict(self.graph)
+    matrix = shortest_path_matrix(graph, ['s', 't', 'x', 'w'] * 3,
+                                  ['s', 't', 'y', 'x', 'z', 'w'],
+                                  workers=2, chunk_size=2)
+    self.assertEqual(matrix.tolist(), self.expected * 3)
+  def test_empty_targets(self):
+    matrix = shortest_path_matrix(self.graph, ['s', 'w'], [], workers=1)
+    self.assertEqual(matrix.shape, (2, 0))
+  def test_unweighted_graph(self):
+    graph = CSRGraph.from_dict({0: [1], 1: [2], 2: []})
+    matrix = shortest_path_matrix(graph, [0, 2], [0, 1, 2], workers=1)
+    self.assertEqual(matrix.tolist(), [[0, 1, 2], [np.inf, np.inf, 0]])
@@ -0,0 +1,103 @@
+import numpy as np
+
+
+def construct_path(previous_vertex, source, target):
+  """
+  Given predecessor links (previous_vertex[v] is the vertex before v on a
+  path from source, either a dictionary or an array indexed by vertex id),
+  returns the path from source to target as a list of vertices, not
+  including source. Walks the links iteratively, so the cost is linear in
+  the length of the path and long paths are not limited by the recursion
+  limit.
+  """
+  path = []
+  v = target
+  while v != source:
+    path.append(v)
+    v = previous_vertex[v]
+  path.reverse()
+  return path
+
+
+def construct_paths(previous_vertex, source, targets):
+  """
+  Same as construct_path for many targets of one predecessor tree, returning
+  a list with one path per target, or None for targets the tree does not
+  reach. When previous_vertex is a NumPy array (-1 marking unreached
+  vertices), all paths are walked in lockstep with one array operation per
+  hop, so the cost is that of the longest path rather than a Python loop
+  over every vertex of every path.
+  """
+  if not isinstance(previous_vertex, np.ndarray):
+    return [construct_path(previous_vertex, source, t)
+            if t in previous_vertex else None for t in targets]
+  targets = np.asarray(targets, dtype=np.int64).reshape(-1)
+  reached = previous_vertex[targets] >= 0
+  lengths = np.zeros(len(targets), dtype=np.int64)
+  # hops[k] holds (path index, vertex) for every path still at least k + 1
+  # hops away from source, walking from the targets backwards.
+  hops = []
+  current = targets.copy()
+  active = np.flatnonzero(reached & (current != source))
+  while len(active):
+    if len(hops) >= len(previous_vertex):
+      raise ValueError('previous_vertex links do not lead back to source')
+    hops.append((active, current[active]))
+    lengths[active] += 1
+    current[active] = previous_vertex[current[active]]
+    active = active[current[active] != source]
+  ends = np.cumsum(lengths)
+  flat = np.empty(ends[-1] if len(ends) else 0, dtype=np.int64)
+  for k, (active, vertices) in enumerate(hops):
+    flat[ends[active] - 1 - k] = vertices
+  return [path.tolist() if ok else None
+          for path, ok in zip(np.split(flat, ends[:-1]), reached.tolist())]
+
+
+
+import unittest
+
+class ConstructPathTest(unittest.TestCase):
+  def test_source_is_target(self):
+    self.assertEqual(construct_path({0: 0}, 0, 0), [])
+  def test_dict_links(self):
+    previous_vertex = {'s': 's', 'a': 's', 'b': 'a', 'c': 's'}
+    self.assertEqual(construct_path(previous_vertex, 's', 'b'), ['a', 'b'])
+    self.assertEqual(construct_path(previous_vertex, 's', 'c'), ['c'])
+  def test_long_path(self):
+    n = 100000
+    previous_vertex = np.arange(-1, n - 1)
+    previous_vertex[0] = 0
+    self.assertEqual(construct_path(previous_vertex, 0, n - 1),
+                     list(range(1, n)))
+
+class ConstructPathsTest(unittest.TestCase):
+  def test_dict_links(self):
+    previous_vertex = {'s': 's', 'a': 's', 'b': 'a'}
+    self.assertEqual(construct_paths(previous_vertex, 's', ['b', 's', 'x']),
+                     [['a', 'b'], [], None])
+  def test_array_links(self):
+    #      0
+    #    /   \
+    #   1     2     5 (unreached)
+    #   |    / \
+    #   3   4   6
+    previous_vertex = np.array([0, 0, 0, 1, 2, -1, 2])
+    self.assertEqual(
+        construct_paths(previous_vertex, 0, [3, 4, 0, 5, 6, 2]),
+        [[1, 3], [2, 4], [], None, [2, 6], [2]])
+  def test_array_links_match_construct_path(self):
+    rng = np.random.RandomState(0)
+    n = 500
+    # Random tree rooted at 0 where each vertex hangs off a lower one.
+    previous_vertex = np.concatenate(
+        [[0], [rng.randint(0, v) for v in range(1, n)]])
+    targets = rng.randint(0, n, size=200)
+    self.assertEqual(
+        construct_paths(previous_vertex, 0, targets),
+        [construct_path(previous_vertex, 0, t) for t in targets.tolist()])
+  def test_no_targets(self):
+    self.assertEqual(construct_paths(np.array([0]), 0, []), [])
+  def test_broken_links(self):
+    previous_vertex = np.array([0, 2, 1])
+    self.assertRaises(ValueError, construct_paths, previous_vertex, 0, [1])
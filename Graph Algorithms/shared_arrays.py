@@ -0,0 +1,75 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedArrays(object):
+  """
+  Copies NumPy arrays into named shared memory blocks so worker processes
+  can map them instead of receiving pickled copies. specs is the small,
+  picklable description workers pass to attach. Use as a context manager,
+  or call close, to release the blocks.
+  """
+  def __init__(self, arrays):
+    self.segments = []
+    self.specs = []
+    self.arrays = []
+    try:
+      for array in arrays:
+        array = np.ascontiguousarray(array)
+        # SharedMemory refuses zero-sized blocks, so empty arrays get a byte.
+        shm = shared_memory.SharedMemory(create=True,
+                                         size=max(array.nbytes, 1))
+        self.segments.append(shm)
+        shared = np.ndarray(array.shape, array.dtype, buffer=shm.buf)
+        shared[...] = array
+        self.arrays.append(shared)
+        self.specs.append((shm.name, array.shape, array.dtype.str))
+    except BaseException:
+      self.close()
+      raise
+
+  def close(self):
+    # Views into the blocks must go before the blocks can be closed.
+    self.arrays = []
+    for shm in self.segments:
+      shm.close()
+      shm.unlink()
+    self.segments = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+def attach(specs):
+  """
+  Maps the arrays described by SharedArrays.specs in this process. Returns
+  the SharedMemory handles, which must be kept alive while the arrays are in
+  use, and the arrays themselves.
+  """
+  segments = [shared_memory.SharedMemory(name=name) for name, _, _ in specs]
+  arrays = [np.ndarray(shape, dtype, buffer=shm.buf)
+            for shm, (_, shape, dtype) in zip(segments, specs)]
+  return segments, arrays
+
+
+
+import unittest
+
+class SharedArraysTest(unittest.TestCase):
+  def test_round_trip(self):
+    source = [np.arange(5), np.array([1.5, 2.5]), np.zeros(0)]
+    with SharedArrays(source) as shared:
+      segments, arrays = attach(shared.specs)
+      for original, mapped in zip(source, arrays):
+        self.assertEqual(mapped.dtype, original.dtype)
+        self.assertEqual(mapped.tolist(), original.tolist())
+      # Writes through one mapping are visible through the other.
+      shared.arrays[0][0] = 42
+      self.assertEqual(arrays[0][0], 42)
+      del arrays
+      for shm in segments:
+        shm.close()
@@ -1,21 +1,107 @@
+import numpy as np
+
+
 class DisjointSet(object):
   def __init__(self, n):
     """
     Initializes a disjoint set structure consisting of n disjoint sets.
+    parent and size are NumPy arrays: parent[x] is x's parent in its set's
+    tree, and size[r] is the number of elements in the set whose
+    representative is r (stale for non-representatives).
     """
-    self.parent = list(range(n))
+    self.parent = np.arange(n, dtype=np.int64)
+    self.size = np.ones(n, dtype=np.int64)
+    self.num_sets = n
+    self._make_views()
+  def _make_views(self):
+    # Single-element access through a memoryview yields plain ints and is
+    # several times faster than indexing the NumPy arrays one element at a
+    # time. The views share memory with the arrays.
+    self._parent_view = memoryview(self.parent)
+    self._size_view = memoryview(self.size)
+  def __getstate__(self):
+    return self.parent, self.size, self.num_sets
+  def __setstate__(self, state):
+    self.parent, self.size, self.num_sets = state
+    self._make_views()
   def find(self, x):
     """Returns the representative element of the set x belongs to."""
-    if self.parent[x] != x:
-      self.parent[x] = self.find(self.parent[x])
-    return self.parent[x]
+    parent = self._parent_view
+    # Path halving: point every other vertex on the way up at its
+    # grandparent, without recursion or a second pass.
+    while parent[x] != x:
+      parent[x] = parent[parent[x]]
+      x = parent[x]
+    return x
   def union(self, x, y):
-    """Joins the sets containing x and y."""
-    self.parent[self.find(x)] = self.find(y)
+    """
+    Joins the sets containing x and y, returning False if they already were
+    the same set.
+    """
+    x, y = self.find(x), self.find(y)
+    if x == y:
+      return False
+    parent, size = self._parent_view, self._size_view
+    # Union by size: hang the smaller tree under the larger one.
+    if size[x] > size[y]:
+      x, y = y, x
+    parent[x] = y
+    size[y] += size[x]
+    self.num_sets -= 1
+    return True
+  def find_many(self, xs):
+    """
+    Returns an array with the representative of each element of xs, walking
+    all of them up their trees at once and compressing the paths taken.
+    """
+    xs = np.asarray(xs, dtype=np.int64)
+    parent = self.parent
+    roots = parent[xs]
+    active = np.flatnonzero(parent[roots] != roots)
+    while len(active):
+      r = roots[active]
+      grandparent = parent[parent[r]]
+      parent[r] = grandparent
+      roots[active] = grandparent
+      active = active[parent[grandparent] != grandparent]
+    parent[xs] = roots
+    return roots
+  def union_many(self, xs, ys):
+    """
+    Joins the sets containing xs[i] and ys[i] for every i, returning the
+    number of merges made.
+    """
+    xs = np.asarray(xs, dtype=np.int64)
+    ys = np.asarray(ys, dtype=np.int64)
+    parent, size = self.parent, self.size
+    merges = 0
+    while len(xs):
+      rx, ry = self.find_many(xs), self.find_many(ys)
+      pending = rx != ry
+      xs, ys, rx, ry = xs[pending], ys[pending], rx[pending], ry[pending]
+      if not len(xs):
+        break
+      # Order each pair of roots by (size, id) and hang the lower one under
+      # the higher. Links only ever point up that order, so no cycles form
+      # even when a root appears in several pairs; when one root is asked to
+      # join several others one assignment wins and the remaining pairs are
+      # retried on the next round.
+      swap = (size[rx] > size[ry]) | ((size[rx] == size[ry]) & (rx > ry))
+      child = np.where(swap, ry, rx)
+      parent[child] = np.where(swap, rx, ry)
+      child = np.sort(child)
+      child = child[np.append(True, child[1:] != child[:-1])]
+      # A new root may itself have been hung under another root this round,
+      # so credit each hung tree's size to the root it finally ended up in.
+      np.add.at(size, self.find_many(child), size[child])
+      merges += len(child)
+    self.num_sets -= merges
+    return merges
     
     
     
     
+import pickle
 import unittest
 class DisjointSetTest(unittest.TestCase):
   def test_initialized_state(self):
@@ -39,3 +125,62 @@ class DisjointSetTest(unittest.TestCase):
       d.union(i - 1, i)
     for i in range(1, 100):
       self.assertEqual(d.find(0), d.find(i))
+  def test_deep_chain(self):
+    n = 100000
+    d = DisjointSet(n)
+    # Link a long chain by hand, as plain parent assignment would without
+    # union by size, and check find neither recurses nor stays slow.
+    d.parent[1:] = np.arange(n - 1)
+    self.assertEqual(d.find(n - 1), 0)
+    self.assertEqual(d.find(n - 1), 0)
+  def test_pickle(self):
+    d = DisjointSet(3)
+    d.union(0, 1)
+    d = pickle.loads(pickle.dumps(d))
+    self.assertEqual(d.find(0), d.find(1))
+    d.union(1, 2)
+    self.assertEqual(d.find(2), d.find(0))
+  def test_union_by_size(self):
+    d = DisjointSet(4)
+    self.assertTrue(d.union(0, 1))
+    self.assertTrue(d.union(2, 0))
+    self.assertFalse(d.union(1, 2))
+    self.assertEqual(d.size[d.find(2)], 3)
+    self.assertEqual(d.num_sets, 2)
+
+class DisjointSetBulkTest(unittest.TestCase):
+  def test_find_many(self):
+    d = DisjointSet(6)
+    d.union(0, 1)
+    d.union(1, 2)
+    d.union(4, 5)
+    roots = d.find_many([0, 1, 2, 3, 4, 5])
+    self.assertEqual(roots.tolist(), [d.find(v) for v in range(6)])
+    self.assertEqual(len(set(roots.tolist())), 3)
+  def test_find_many_long_chain(self):
+    n = 1000
+    d = DisjointSet(n)
+    d.parent[1:] = np.arange(n - 1)
+    self.assertEqual(d.find_many([n - 1, n // 2]).tolist(), [0, 0])
+  def test_union_many_matches_union(self):
+    rng = np.random.RandomState(0)
+    for n in (1, 10, 200):
+      xs = rng.randint(0, n, size=n)
+      ys = rng.randint(0, n, size=n)
+      bulk, single = DisjointSet(n), DisjointSet(n)
+      merges = bulk.union_many(xs, ys)
+      self.assertEqual(merges, sum(single.union(x, y)
+                                   for x, y in zip(xs.tolist(), ys.tolist())))
+      self.assertEqual(bulk.num_sets, single.num_sets)
+      bulk_roots = bulk.find_many(np.arange(n)).tolist()
+      single_roots = [single.find(v) for v in range(n)]
+      # Same partition, possibly with different representatives.
+      self.assertEqual(len(set(zip(bulk_roots, single_roots))),
+                       single.num_sets)
+      for r in set(bulk_roots):
+        self.assertEqual(bulk.size[r], bulk_roots.count(r))
+  def test_union_many_star(self):
+    d = DisjointSet(5)
+    self.assertEqual(d.union_many([0, 0, 0, 0], [1, 2, 3, 4]), 4)
+    self.assertEqual(d.num_sets, 1)
+    self.assertEqual(d.size[d.find(3)], 5)
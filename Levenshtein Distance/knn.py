@@ -1,3 +1,5 @@
+import heapq
+
 import numpy as np
 from sklearn import datasets
 iris = datasets.load_iris()
@@ -93,6 +95,138 @@ for i in range(5):
     
     
 
+class NeighborIndex(object):
+    """
+    NeighborIndex builds a space-partitioning tree over the
+    training set, so that the k nearest neighbors of an instance
+    (by Euclidean distance) can be found without computing the
+    distance to every training instance.
+    kind is 'kd' for a KD-tree, which bounds every node by a box
+    and works best in low dimensions, 'ball' for a ball tree,
+    which bounds every node by a sphere and holds up better in
+    high dimensions, or 'auto' to choose a KD-tree up to
+    kd_max_dim dimensions and a ball tree otherwise.
+    Every node is split at the median of its widest dimension
+    until it holds at most leaf_size instances.
+    """
+    kd_max_dim = 16
+
+    def __init__(self, training_set, labels, leaf_size=16, kind='auto'):
+        self.training_set = training_set
+        self.labels = labels
+        self.points = np.asarray(training_set, dtype=float)
+        if self.points.ndim == 1:
+            self.points = self.points.reshape(-1, 1)
+        if kind == 'auto':
+            kind = 'kd' if self.points.shape[1] <= self.kd_max_dim else 'ball'
+        if kind not in ('kd', 'ball'):
+            raise ValueError("kind must be 'kd', 'ball' or 'auto', not %r"
+                             % (kind,))
+        self.kind = kind
+        self.leaf_size = leaf_size
+        self._build()
+
+    def _build(self):
+        points = self.points
+        # order[start:end] are the training indices under a node
+        self.order = np.arange(len(points))
+        starts, ends, children, bounds = [], [], [], []
+        stack = [(0, len(points), None)]
+        while stack:
+            start, end, parent = stack.pop()
+            node = len(starts)
+            if parent is not None:
+                children[parent[0]][parent[1]] = node
+            members = points[self.order[start:end]]
+            if self.kind == 'kd':
+                bounds.append((members.min(axis=0), members.max(axis=0)))
+            else:
+                center = members.mean(axis=0)
+                radius = np.sqrt(((members - center) ** 2).sum(axis=1).max())
+                bounds.append((center, radius))
+            starts.append(start)
+            ends.append(end)
+            children.append([-1, -1])
+            if end - start <= self.leaf_size:
+                continue
+            spread = members.max(axis=0) - members.min(axis=0)
+            dim = np.argmax(spread)
+            if spread[dim] == 0:
+                # all instances coincide, nothing to split
+                continue
+            middle = (end - start) // 2
+            part = np.argpartition(members[:, dim], middle)
+            self.order[start:end] = self.order[start:end][part]
+            stack.append((start + middle, end, (node, 1)))
+            stack.append((start, start + middle, (node, 0)))
+        self.starts, self.ends = starts, ends
+        self.children = children
+        self.bounds = bounds
+
+    def _min_distance(self, node, instance):
+        # a lower bound on the distance from instance to anything
+        # under node
+        if self.kind == 'kd':
+            low, high = self.bounds[node]
+            gap = np.maximum(low - instance, 0) + np.maximum(instance - high, 0)
+            return np.sqrt((gap ** 2).sum())
+        center, radius = self.bounds[node]
+        return max(np.sqrt(((instance - center) ** 2).sum()) - radius, 0)
+
+    def get_neighbors(self, test_instance, k):
+        """
+        get_neighbors returns the same list of k 3-tuples
+        (instance, dist, label), sorted by dist, as the function
+        get_neighbors with the default Euclidean distance.
+        """
+        instance = np.asarray(test_instance, dtype=float).reshape(-1)
+        k = min(k, len(self.points))
+        if k <= 0:
+            return []
+        # max-heap of the best k so far as (-dist, -index), so that
+        # ties keep the training set order like a stable sort does
+        best = []
+        stack = [(0.0, 0)]
+        while stack:
+            bound, node = stack.pop()
+            if len(best) == k and bound > -best[0][0]:
+                continue
+            left, right = self.children[node]
+            if left < 0:
+                indices = self.order[self.starts[node]:self.ends[node]]
+                dists = np.sqrt(((self.points[indices] - instance) ** 2)
+                                .sum(axis=1))
+                for index, dist in zip(indices.tolist(), dists.tolist()):
+                    entry = (-dist, -index)
+                    if len(best) < k:
+                        heapq.heappush(best, entry)
+                    elif entry > best[0]:
+                        heapq.heapreplace(best, entry)
+                continue
+            near = [(self._min_distance(child, instance), child)
+                    for child in (left, right)]
+            # the nearer child is popped, and searched, first
+            near.sort(reverse=True)
+            stack.extend(near)
+        best.sort(reverse=True)
+        return [(self.training_set[-index], -dist, self.labels[-index])
+                for dist, index in best]
+
+
+index = NeighborIndex(learnset_data, learnset_labels)
+for i in range(5):
+    neighbors = index.get_neighbors(testset_data[i], 3)
+    print(i, 
+          testset_data[i], 
+          testset_labels[i], 
+          neighbors)
+    
+    
+    
+    
+    
+    
+
 def vote_prob(neighbors):
     class_counter = Counter()
     for neighbor in neighbors:
@@ -176,6 +310,73 @@ for i in range(n_training_samples):
     print("index: ", i, 
           ", result of vote: ", vote_distance_weights(neighbors,
                                                       all_results=True))
+
+                                                      
+                                                      
+                                                      
+def predict_batch(train_X, train_y, test_X, k, vote='harmonic',
+                  block_size=256):
+    """
+    predict_batch classifies every row of test_X by its k nearest
+    (Euclidean) neighbors in train_X, like calling get_neighbors
+    and a vote function per row, but for all rows at once.
+    vote is 'prob' (one vote per neighbor, as vote_prob),
+    'harmonic' (1/(index+1), as vote_harmonic_weights) or
+    'distance' (1/(dist**2+1), as vote_distance_weights).
+    Distances are computed block_size test rows at a time from
+    |a|**2 - 2*a.b + |b|**2 with one matrix multiplication, so at
+    most block_size x len(train_X) distances are held in memory;
+    np.argpartition picks the k nearest of each row without
+    sorting the rest and np.bincount tallies the votes.
+    It returns (predictions, votes, classes): the winning label
+    of every row, the normalized votes of every class as a
+    len(test_X) x len(classes) array, and the sorted labels the
+    columns of votes stand for. Ties go to the smallest label.
+    """
+    if vote not in ('prob', 'harmonic', 'distance'):
+        raise ValueError("vote must be 'prob', 'harmonic' or 'distance', "
+                         "not %r" % (vote,))
+    train_X = np.asarray(train_X, dtype=float)
+    test_X = np.asarray(test_X, dtype=float)
+    classes, train_classes = np.unique(train_y, return_inverse=True)
+    k = min(k, len(train_X))
+    n_classes = len(classes)
+    train_norms = (train_X ** 2).sum(axis=1)
+    votes = np.zeros((len(test_X), n_classes))
+    for start in range(0, len(test_X), block_size):
+        block = test_X[start:start + block_size]
+        squared = ((block ** 2).sum(axis=1)[:, np.newaxis]
+                   - 2 * block @ train_X.T + train_norms)
+        # rounding can make the distance of (nearly) equal points
+        # slightly negative
+        np.maximum(squared, 0, out=squared)
+        rows = np.arange(len(block))[:, np.newaxis]
+        if k < len(train_X):
+            nearest = np.argpartition(squared, k - 1, axis=1)[:, :k]
+        else:
+            nearest = np.tile(np.arange(len(train_X)), (len(block), 1))
+        # the harmonic weights depend on the rank of each neighbor
+        nearest = nearest[rows, np.argsort(squared[rows, nearest], axis=1,
+                                           kind='stable')]
+        if vote == 'prob':
+            weights = np.ones(nearest.shape)
+        elif vote == 'harmonic':
+            weights = np.broadcast_to(1 / np.arange(1, k + 1), nearest.shape)
+        else:
+            weights = 1 / (squared[rows, nearest] + 1)
+        keys = rows * n_classes + train_classes[nearest]
+        votes[start:start + len(block)] = np.bincount(
+            keys.ravel(), weights=weights.ravel(),
+            minlength=len(block) * n_classes).reshape(len(block), n_classes)
+    totals = votes.sum(axis=1, keepdims=True)
+    np.divide(votes, totals, out=votes, where=totals > 0)
+    return classes[votes.argmax(axis=1)], votes, classes
+
+
+predictions, votes, classes = predict_batch(learnset_data, learnset_labels,
+                                            testset_data, 6)
+print("predictions: ", predictions)
+print("labels: ", testset_labels)
                                                       
                                                       
                                                       
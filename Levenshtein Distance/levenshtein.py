@@ -13,7 +13,7 @@ cities = {"Pittsburgh":"Pennsylvania",
 Recursive Levenshtein Function in Python
 '''
 
-from collections import Counter
+from collections import Counter, OrderedDict
 def call_counter(func):
     def helper(*args, **kwargs):
         helper.calls += 1
@@ -47,7 +47,53 @@ def call_counter(func):
     helper.calls = 0
     helper.__name__= func.__name__
     return helper
-memo = {}
+class LRUCache(object):
+    """
+        LRUCache(maxsize) -> cache
+        A dictionary-like cache holding at most maxsize entries.
+        When a new entry would exceed maxsize, the least recently
+        used entry is evicted. hits, misses and evictions count
+        what happened to get and __setitem__ calls since the
+        cache was created or last cleared.
+    """
+    def __init__(self, maxsize=2 ** 16):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.data.clear()
+        self.hits = self.misses = self.evictions = 0
+
+
+# shared by both memoized versions of levenshtein below, keyed on
+# the (s, t) pair
+memo = LRUCache()
 @call_counter
 def levenshtein(s, t):
     if s == "":
@@ -56,16 +102,16 @@ def levenshtein(s, t):
         return len(s)
     cost = 0 if s[-1] == t[-1] else 1
        
-    i1 = (s[:-1], t)
-    if not i1 in memo:
-        memo[i1] = levenshtein(*i1)
-    i2 = (s, t[:-1])
-    if not i2 in memo:
-        memo[i2] = levenshtein(*i2)
-    i3 = (s[:-1], t[:-1])
-    if not i3 in memo:
-        memo[i3] = levenshtein(*i3)
-    res = min([memo[i1]+1, memo[i2]+1, memo[i3]+cost])
+    # the values are kept in locals since computing one pair can
+    # evict another from the bounded memo
+    results = []
+    for i in ((s[:-1], t), (s, t[:-1]), (s[:-1], t[:-1])):
+        res = memo.get(i)
+        if res is None:
+            res = levenshtein(*i)
+            memo[i] = res
+        results.append(res)
+    res = min([results[0]+1, results[1]+1, results[2]+cost])
     
     return res
  
@@ -79,16 +125,26 @@ def call_counter(func):
     helper.calls = 0
     helper.__name__= func.__name__
     return helper
-def memoize(func):
-    mem = {}
-    def memoizer(*args, **kwargs):
-        key = str(args) + str(kwargs)
-        if key not in mem:
-            mem[key] = func(*args, **kwargs)
-        return mem[key]
-    return memoizer
+def memoize(cache):
+    """
+        memoize(cache) -> decorator
+        Memoizes a function in the given LRUCache, keyed on the
+        argument tuple itself rather than on its string form.
+    """
+    def decorator(func):
+        def memoizer(*args, **kwargs):
+            key = args + (frozenset(kwargs.items()),) if kwargs else args
+            res = cache.get(key)
+            if res is None:
+                res = func(*args, **kwargs)
+                cache[key] = res
+            return res
+        memoizer.cache = cache
+        memoizer.__name__ = func.__name__
+        return memoizer
+    return decorator
 @call_counter
-@memoize    
+@memoize(memo)
 def levenshtein(s, t):
     if s == "":
         return len(t)
@@ -153,7 +209,7 @@ def iterative_levenshtein(s, t):
  
  
  
- def iterative_levenshtein(s, t, costs=(1, 1, 1)):
+def iterative_levenshtein(s, t, costs=(1, 1, 1)):
     """ 
         iterative_levenshtein(s, t) -> ldist
         ldist is the Levenshtein distance between the strings 
@@ -249,3 +305,788 @@ def iterative_levenshtein(s, t, **weight_dict):
     return dist[row][col]
  
 
+
+
+
+'''
+Threshold-bounded Levenshtein Distance
+'''
+
+def bounded_levenshtein(s, t, k):
+    """
+        bounded_levenshtein(s, t, k) -> ldist
+        ldist is the Levenshtein distance between the strings
+        s and t if it is at most k, and k + 1 otherwise.
+        Only the diagonal band of width 2k+1 around dist[i,i] is
+        computed, since a cell further than k from the diagonal
+        already costs more than k, and the computation stops as
+        soon as a whole row of the band exceeds k. This takes
+        O(k*len(s)) time and O(len(t)) memory instead of
+        O(len(s)*len(t)).
+    """
+    rows = len(s)
+    cols = len(t)
+    # the length difference alone needs that many insertions
+    # or deletions
+    if abs(rows - cols) > k:
+        return k + 1
+    too_far = k + 1
+    previous = [col if col <= k else too_far for col in range(cols + 1)]
+    current = [too_far] * (cols + 1)
+    for row in range(1, rows + 1):
+        first = max(1, row - k)
+        last = min(cols, row + k)
+        # the cell left of the band, which is dist[row,0] on the
+        # rows where the band touches the first column
+        current[first - 1] = row if row <= k else too_far
+        row_min = current[first - 1]
+        char = s[row - 1]
+        for col in range(first, last + 1):
+            value = previous[col - 1] + (char != t[col - 1])  # substitution
+            if previous[col] + 1 < value:                      # deletion
+                value = previous[col] + 1
+            if current[col - 1] + 1 < value:                   # insertion
+                value = current[col - 1] + 1
+            if value > too_far:
+                value = too_far
+            current[col] = value
+            if value < row_min:
+                row_min = value
+        if row_min > k:
+            return too_far
+        # the next row's band reaches one column further right
+        if last < cols:
+            current[last + 1] = too_far
+        previous, current = current, previous
+    return previous[cols]
+
+
+def levenshtein_within(s, t, k):
+    """
+        levenshtein_within(s, t, k) -> bool
+        True if the Levenshtein distance between the strings s
+        and t is at most k, computed with bounded_levenshtein.
+    """
+    return bounded_levenshtein(s, t, k) <= k
+
+
+
+'''
+Two-Row Levenshtein Distance with Reusable Buffers
+'''
+
+class TwoRowLevenshtein(object):
+    """
+        TwoRowLevenshtein(costs=(1, 1, 1), **weight_dict)
+        A Levenshtein distance calculator for computing many
+        distances with the same costs: calling it as
+        distance(s, t) -> ldist gives the same result as
+        iterative_levenshtein with these costs, but never prints.
+        Only the previous and current rows of dist are kept, in
+        lists that are allocated once and reused by every call
+        (they only grow when a longer t comes along), so memory
+        is O(len(t)). An instance is not safe to share between
+        threads.
+
+        costs: a tuple or a list with three integers (d, i, s)
+               where d defines the costs for a deletion
+                     i defines the costs for an insertion and
+                     s defines the costs for a substitution
+        weight_dict: keyword parameters setting the (d, i, s)
+                     costs for single characters, the others
+                     use costs
+    """
+    def __init__(self, costs=(1, 1, 1), **weight_dict):
+        self.costs = tuple(costs)
+        self.weight_dict = weight_dict
+        self.previous = []
+        self.current = []
+        # per-character insertion and substitution costs of t,
+        # only used with weight_dict
+        self.inserts = []
+        self.substitutes = []
+
+    def _reserve(self, cols):
+        missing = cols + 1 - len(self.previous)
+        if missing > 0:
+            for buffer in (self.previous, self.current,
+                           self.inserts, self.substitutes):
+                buffer.extend([0] * missing)
+
+    def __call__(self, s, t):
+        self._reserve(len(t))
+        if self.weight_dict:
+            return self._weighted(s, t)
+        return self._uniform(s, t)
+
+    def _uniform(self, s, t):
+        deletes, inserts, substitutes = self.costs
+        previous, current = self.previous, self.current
+        cols = len(t)
+        for col in range(cols + 1):
+            previous[col] = col * inserts
+        for row, char in enumerate(s, 1):
+            left = current[0] = row * deletes
+            diagonal = previous[0]
+            for col, other in enumerate(t, 1):
+                up = previous[col]
+                value = diagonal if char == other else diagonal + substitutes
+                if up + deletes < value:
+                    value = up + deletes
+                if left + inserts < value:
+                    value = left + inserts
+                current[col] = left = value
+                diagonal = up
+            previous, current = current, previous
+        return previous[cols]
+
+    def _weighted(self, s, t):
+        w = self.weight_dict
+        default = self.costs
+        previous, current = self.previous, self.current
+        t_inserts, t_substitutes = self.inserts, self.substitutes
+        cols = len(t)
+        previous[0] = 0
+        for col, other in enumerate(t, 1):
+            weights = w.get(other, default)
+            t_inserts[col] = weights[1]
+            t_substitutes[col] = weights[2]
+            previous[col] = previous[col - 1] + weights[1]
+        for char in s:
+            deletes, _, substitutes = w.get(char, default)
+            left = current[0] = previous[0] + deletes
+            diagonal = previous[0]
+            for col, other in enumerate(t, 1):
+                up = previous[col]
+                if char == other:
+                    value = diagonal
+                else:
+                    value = diagonal + max(substitutes, t_substitutes[col])
+                if up + deletes < value:
+                    value = up + deletes
+                if left + t_inserts[col] < value:
+                    value = left + t_inserts[col]
+                current[col] = left = value
+                diagonal = up
+            previous, current = current, previous
+        return previous[cols]
+
+
+
+'''
+Bit-Parallel Levenshtein Distance (Myers / Hyyro)
+'''
+
+def bit_parallel_levenshtein(s, t):
+    """
+        bit_parallel_levenshtein(s, t) -> ldist
+        ldist is the Levenshtein distance between the strings
+        s and t with unit costs, computed with Myers' bit-vector
+        algorithm in Hyyro's formulation. A column of dist is not
+        stored as numbers but as two bit vectors marking where
+        it goes up (Pv) or down (Mv) by one from the row above,
+        so a whole column is updated with a handful of integer
+        operations per character of t.
+        The bit vectors are Python integers, which have as many
+        bits as needed, so strings longer than a machine word
+        are handled the same way, in blocks of machine words
+        inside the integer arithmetic.
+    """
+    # the longer string goes in the bit vectors, which keeps
+    # the loop below as short as possible
+    if len(s) < len(t):
+        s, t = t, s
+    rows = len(s)
+    if rows == 0:
+        return len(t)
+    # peq[c] has bit i set where s[i] == c
+    peq = {}
+    for i, char in enumerate(s):
+        peq[char] = peq.get(char, 0) | (1 << i)
+    mask = (1 << rows) - 1
+    last = 1 << (rows - 1)
+    pv = mask
+    mv = 0
+    score = rows
+    for char in t:
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = ((((eq & pv) + pv) & mask) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        # dist[0,j] grows by one every column, so a 1 is
+        # shifted into the horizontal positive deltas
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+    return score
+
+
+# one calculator for every 'two_row' call, so its row buffers are
+# allocated once and only grow; like any TwoRowLevenshtein it is not
+# safe to share between threads
+_two_row_levenshtein = TwoRowLevenshtein()
+
+
+# Unit-cost engines for levenshtein_distance, all returning the same
+# distance.
+ENGINES = {
+    'two_row': _two_row_levenshtein,
+    'bit_parallel': bit_parallel_levenshtein,
+}
+
+
+def levenshtein_distance(s, t, engine='bit_parallel'):
+    """
+        levenshtein_distance(s, t, engine='bit_parallel') -> ldist
+        ldist is the Levenshtein distance between the strings
+        s and t with unit costs, computed by the named engine,
+        one of the keys of ENGINES.
+    """
+    if engine not in ENGINES:
+        raise ValueError('Unknown levenshtein engine %r, expected one of %s'
+                         % (engine, sorted(ENGINES)))
+    return ENGINES[engine](s, t)
+
+
+
+'''
+Edit Distance Matrix for Many Strings
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# bits per word of the bit vectors used by levenshtein_matrix
+WORD = 64
+
+
+def _encode(strings, alphabet):
+    """
+        _encode(strings, alphabet) -> codes, lengths
+        codes holds every character of the strings, one after the
+        other, as its index in the sorted array of code points
+        alphabet, and lengths the length of each string.
+    """
+    lengths = np.array([len(s) for s in strings], dtype=np.int64)
+    points = np.frombuffer(''.join(strings).encode('utf-32-le'),
+                           dtype=np.uint32)
+    return np.searchsorted(alphabet, points).astype(np.int32), lengths
+
+
+def _corpus_blocks(codes, lengths, block_size):
+    """
+        _corpus_blocks(codes, lengths, block_size) -> blocks
+        Splits the corpus into blocks of block_size strings of
+        similar length, each block a tuple (ids, lengths, table)
+        sorted by length, where table[j] holds the j-th character
+        code of every string in the block, padded with -1.
+    """
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    order = np.argsort(lengths, kind='stable')
+    blocks = []
+    for first in range(0, len(order), block_size):
+        ids = order[first:first + block_size]
+        block_lengths = lengths[ids]
+        table = np.full((block_lengths.max() if len(ids) else 0, len(ids)),
+                        -1, dtype=np.int32)
+        for j in range(table.shape[0]):
+            has_char = np.flatnonzero(block_lengths > j)
+            table[j, has_char] = codes[starts[ids[has_char]] + j]
+        blocks.append((ids, block_lengths, table))
+    return blocks
+
+
+def _pattern_masks(query, alphabet_size):
+    """
+        _pattern_masks(query, alphabet_size) -> peq
+        peq[w, c] has bit i set where query[w * WORD + i] == c,
+        with an extra all-zero column for the padding code -1.
+    """
+    words = max(1, -(-len(query) // WORD))
+    peq = np.zeros((words, alphabet_size + 1), dtype=np.uint64)
+    positions = np.arange(len(query))
+    np.bitwise_or.at(peq, (positions // WORD, query),
+                     np.left_shift(np.uint64(1),
+                                   (positions % WORD).astype(np.uint64)))
+    return peq
+
+
+def _block_distances(peq, rows, table, lengths):
+    """
+        _block_distances(peq, rows, table, lengths) -> ldists
+        The Levenshtein distances between a query of length rows,
+        given by its pattern masks, and every string of a block.
+        This is bit_parallel_levenshtein run on all the strings
+        at once, with the query split into WORD-bit words that
+        pass their horizontal delta on to the next word (Myers'
+        blocked algorithm).
+    """
+    count = table.shape[1]
+    if rows == 0:
+        return lengths.copy()
+    words = peq.shape[0]
+    one = np.uint64(1)
+    high = np.uint64(1 << (WORD - 1))
+    last = np.uint64(1 << ((rows - 1) % WORD))
+    pv = np.full((words, count), np.uint64(2 ** WORD - 1))
+    mv = np.zeros((words, count), dtype=np.uint64)
+    score = np.full(count, rows, dtype=np.int64)
+    for j in range(table.shape[0]):
+        chars = table[j]
+        # dist[0,j] grows by one every column
+        hin = np.ones(count, dtype=np.int64)
+        for w in range(words):
+            eq = peq[w][chars]
+            xv = eq | mv[w]
+            eq |= (hin < 0).astype(np.uint64)
+            xh = (((eq & pv[w]) + pv[w]) ^ pv[w]) | eq
+            ph = mv[w] | ~(xh | pv[w])
+            mh = pv[w] & xh
+            top = last if w == words - 1 else high
+            hout = (ph & top != 0).astype(np.int64) - (mh & top != 0)
+            ph = (ph << one) | (hin > 0).astype(np.uint64)
+            mh = (mh << one) | (hin < 0).astype(np.uint64)
+            pv[w] = mh | ~(xv | ph)
+            mv[w] = ph & xv
+            hin = hout
+        # strings shorter than j have already been scored
+        score += np.where(lengths > j, hin, 0)
+    return score
+
+
+def _distance_rows(corpus, queries, max_dist):
+    """
+        _distance_rows(corpus, queries, max_dist) -> rows
+        For each encoded query, the pair (ids, ldists) of corpus
+        strings within max_dist of it (all of them if max_dist
+        is None) and their distances.
+    """
+    blocks, alphabet_size = corpus
+    rows = []
+    for query in queries:
+        peq = _pattern_masks(query, alphabet_size)
+        row_ids, row_dists = [], []
+        for ids, lengths, table in blocks:
+            if max_dist is not None:
+                # strings whose length differs by more than max_dist
+                # need more edits than that, and the block is sorted
+                # by length
+                lo = np.searchsorted(lengths, len(query) - max_dist)
+                hi = np.searchsorted(lengths, len(query) + max_dist,
+                                     side='right')
+                if lo == hi:
+                    continue
+                ids, lengths = ids[lo:hi], lengths[lo:hi]
+                table = table[:lengths[-1], lo:hi]
+            dists = _block_distances(peq, len(query), table, lengths)
+            if max_dist is not None:
+                within = dists <= max_dist
+                ids, dists = ids[within], dists[within]
+            row_ids.append(ids)
+            row_dists.append(dists)
+        rows.append((np.concatenate(row_ids) if row_ids else
+                     np.zeros(0, dtype=np.int64),
+                     np.concatenate(row_dists) if row_dists else
+                     np.zeros(0, dtype=np.int64)))
+    return rows
+
+
+# set in each worker process by _set_corpus
+_worker_corpus = None
+
+
+def _set_corpus(corpus):
+    global _worker_corpus
+    _worker_corpus = corpus
+
+
+def _worker_distance_rows(queries, max_dist):
+    return _distance_rows(_worker_corpus, queries, max_dist)
+
+
+def levenshtein_matrix(queries, corpus, max_dist=None, workers=None,
+                       chunk_size=64, block_size=1 << 14):
+    """
+        levenshtein_matrix(queries, corpus, max_dist=None) -> matrix
+        The unit-cost Levenshtein distances from every string of
+        queries to every string of corpus, as a dense
+        len(queries) x len(corpus) NumPy array. If max_dist is
+        given, the result is a scipy.sparse CSR matrix holding only
+        the pairs with distance at most max_dist; exact matches
+        are stored as explicit zeros, so use the sparsity
+        structure rather than the values to find the pairs.
+        The strings are encoded as integer arrays and the corpus
+        is grouped into blocks of block_size strings of similar
+        length. Each query is then compared with a whole block at
+        once by a vectorized bit-parallel algorithm, and with
+        max_dist only against the corpus strings whose length is
+        close enough to its own. The queries are split into
+        chunks of chunk_size and run on a ProcessPoolExecutor with
+        the given number of workers (None means one per CPU, 1
+        runs everything in this process).
+    """
+    queries = list(queries)
+    corpus = list(corpus)
+    alphabet = np.unique(np.frombuffer(
+        ''.join(queries + corpus).encode('utf-32-le'), dtype=np.uint32))
+    query_codes, query_lengths = _encode(queries, alphabet)
+    corpus_data = (_corpus_blocks(*_encode(corpus, alphabet),
+                                  block_size=block_size),
+                   len(alphabet))
+    ends = np.cumsum(query_lengths)
+    queries = [query_codes[end - length:end]
+               for end, length in zip(ends.tolist(), query_lengths.tolist())]
+    chunks = [queries[i:i + chunk_size]
+              for i in range(0, len(queries), chunk_size)]
+    if workers == 1 or len(chunks) <= 1:
+        rows = _distance_rows(corpus_data, queries, max_dist)
+    else:
+        with ProcessPoolExecutor(workers, initializer=_set_corpus,
+                                 initargs=(corpus_data,)) as executor:
+            rows = [row for chunk_rows in
+                    executor.map(_worker_distance_rows, chunks,
+                                 [max_dist] * len(chunks))
+                    for row in chunk_rows]
+    shape = (len(queries), len(corpus))
+    if max_dist is None:
+        matrix = np.empty(shape, dtype=np.int64)
+        for i, (ids, dists) in enumerate(rows):
+            matrix[i, ids] = dists
+        return matrix
+    from scipy import sparse
+    row_index = np.repeat(np.arange(len(rows)), [len(ids) for ids, _ in rows])
+    ids = np.concatenate([ids for ids, _ in rows] + [np.zeros(0, np.int64)])
+    dists = np.concatenate([d for _, d in rows] + [np.zeros(0, np.int64)])
+    return sparse.csr_matrix((dists, (row_index, ids)), shape=shape)
+
+
+
+'''
+Fuzzy Lookup with a BK-Tree
+'''
+
+class FuzzyIndex(object):
+    """
+        FuzzyIndex(vocabulary, distance=bit_parallel_levenshtein)
+        A BK-tree over the strings of vocabulary for finding every
+        entry within a given distance of a query without comparing
+        it to all of them. Each node keeps its children by their
+        distance to it, and since distance must be a metric, a
+        query within k of some entry can only be found under
+        children whose distance to the node differs from the
+        query's by at most k.
+        The tree is stored as flat lists (entry i, and a dict from
+        distance to child index per entry) instead of nested node
+        objects, so it can be pickled once and loaded quickly in
+        every worker. distance must be picklable too, e.g. a
+        module-level function.
+    """
+    def __init__(self, vocabulary=(), distance=bit_parallel_levenshtein):
+        self.distance = distance
+        self.entries = []
+        self.children = []
+        for word in vocabulary:
+            self.add(word)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, word):
+        """
+            add(word) -> bool
+            Adds word to the index, returning False if it was
+            already there.
+        """
+        if not self.entries:
+            self.entries.append(word)
+            self.children.append({})
+            return True
+        node = 0
+        while True:
+            d = self.distance(word, self.entries[node])
+            if d == 0:
+                return False
+            child = self.children[node].get(d)
+            if child is None:
+                self.children[node][d] = len(self.entries)
+                self.entries.append(word)
+                self.children.append({})
+                return True
+            node = child
+
+    def query(self, s, k):
+        """
+            query(s, k) -> matches
+            matches is the list of (entry, ldist) pairs for every
+            entry within distance k of s, sorted by distance.
+        """
+        if not self.entries:
+            return []
+        matches = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            d = self.distance(s, self.entries[node])
+            if d <= k:
+                matches.append((self.entries[node], d))
+            for child_distance, child in self.children[node].items():
+                if d - k <= child_distance <= d + k:
+                    stack.append(child)
+        matches.sort(key=lambda match: match[1])
+        return matches
+
+
+
+import contextlib
+import io
+import random
+import unittest
+
+
+def reference_levenshtein(s, t, costs=(1, 1, 1)):
+    """
+        reference_levenshtein(s, t, costs=(1, 1, 1)) -> ldist
+        iterative_levenshtein with the same (d, i, s) costs for
+        every letter, without the matrix it prints. s and t must
+        be non-empty strings of ASCII letters, and cannot contain
+        's' or 't' unless costs are the default, since the weights
+        for those letters would clash with the argument names.
+    """
+    weights = dict.fromkeys(set(s + t), costs) if costs != (1, 1, 1) else {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        return iterative_levenshtein(s, t, **weights)
+
+
+def random_string(rng, length, alphabet='abc'):
+    return ''.join(rng.choice(alphabet) for _ in range(length))
+
+
+class BoundedLevenshteinTest(unittest.TestCase):
+    def test_matches_full_distance(self):
+        rng = random.Random(0)
+        for _ in range(300):
+            s = random_string(rng, rng.randint(1, 12))
+            t = random_string(rng, rng.randint(1, 12))
+            d = reference_levenshtein(s, t)
+            for k in range(8):
+                self.assertEqual(bounded_levenshtein(s, t, k), min(d, k + 1))
+                self.assertEqual(levenshtein_within(s, t, k), d <= k)
+    def test_empty_strings(self):
+        self.assertEqual(bounded_levenshtein('', '', 0), 0)
+        self.assertEqual(bounded_levenshtein('', 'abc', 3), 3)
+        self.assertEqual(bounded_levenshtein('abc', '', 2), 3)
+
+
+class TwoRowLevenshteinTest(unittest.TestCase):
+    def test_unit_costs(self):
+        distance = TwoRowLevenshtein()
+        rng = random.Random(1)
+        for _ in range(200):
+            s = random_string(rng, rng.randint(1, 12))
+            t = random_string(rng, rng.randint(1, 12))
+            self.assertEqual(distance(s, t), reference_levenshtein(s, t))
+    def test_costs(self):
+        rng = random.Random(2)
+        for costs in ((1, 1, 1), (2, 3, 1), (1, 1, 3), (4, 1, 2)):
+            distance = TwoRowLevenshtein(costs)
+            for _ in range(50):
+                s = random_string(rng, rng.randint(1, 10))
+                t = random_string(rng, rng.randint(1, 10))
+                self.assertEqual(distance(s, t),
+                                 reference_levenshtein(s, t, costs))
+    def test_weight_dict(self):
+        rng = random.Random(3)
+        for _ in range(20):
+            weights = dict((char, tuple(rng.randint(1, 4) for _ in range(3)))
+                           for char in 'abcd' if rng.random() < 0.7)
+            distance = TwoRowLevenshtein(**weights)
+            for _ in range(10):
+                s = random_string(rng, rng.randint(1, 10), 'abcde')
+                t = random_string(rng, rng.randint(1, 10), 'abcde')
+                with contextlib.redirect_stdout(io.StringIO()):
+                    expected = iterative_levenshtein(s, t, **weights)
+                self.assertEqual(distance(s, t), expected)
+    def test_buffers_are_reused(self):
+        distance = TwoRowLevenshtein()
+        self.assertEqual(distance('kitten', 'sitting'), 3)
+        buffer = distance.previous
+        self.assertEqual(distance('abc', 'abd'), 1)
+        self.assertEqual(distance('flaw', 'lawn'), 2)
+        self.assertIs(distance.previous, buffer)
+        self.assertEqual(len(buffer), len('sitting') + 1)
+    def test_empty_strings(self):
+        distance = TwoRowLevenshtein((2, 3, 1))
+        self.assertEqual(distance('', ''), 0)
+        self.assertEqual(distance('', 'ab'), 6)
+        self.assertEqual(distance('ab', ''), 4)
+
+
+class BitParallelLevenshteinTest(unittest.TestCase):
+    def test_matches_reference(self):
+        rng = random.Random(4)
+        for _ in range(200):
+            s = random_string(rng, rng.randint(1, 12))
+            t = random_string(rng, rng.randint(1, 12))
+            self.assertEqual(bit_parallel_levenshtein(s, t),
+                             reference_levenshtein(s, t))
+    def test_longer_than_a_word(self):
+        rng = random.Random(5)
+        distance = TwoRowLevenshtein()
+        for _ in range(20):
+            s = random_string(rng, rng.randint(60, 200), 'abcd')
+            t = random_string(rng, rng.randint(60, 200), 'abcd')
+            self.assertEqual(bit_parallel_levenshtein(s, t), distance(s, t))
+    def test_empty_strings(self):
+        self.assertEqual(bit_parallel_levenshtein('', ''), 0)
+        self.assertEqual(bit_parallel_levenshtein('', 'abc'), 3)
+        self.assertEqual(bit_parallel_levenshtein('ab', ''), 2)
+    def test_engines_agree(self):
+        rng = random.Random(6)
+        for _ in range(50):
+            s = random_string(rng, rng.randint(0, 80))
+            t = random_string(rng, rng.randint(0, 80))
+            self.assertEqual(len(set(levenshtein_distance(s, t, engine)
+                                     for engine in ENGINES)), 1)
+    def test_two_row_engine_reuses_its_buffers(self):
+        self.assertIs(ENGINES['two_row'], _two_row_levenshtein)
+        levenshtein_distance('abcdef', 'abc', 'two_row')
+        buffer = _two_row_levenshtein.previous
+        self.assertEqual(levenshtein_distance('ab', 'b', 'two_row'), 1)
+        self.assertIs(_two_row_levenshtein.previous, buffer)
+    def test_unknown_engine(self):
+        self.assertRaises(ValueError, levenshtein_distance, 'a', 'b', 'numpy')
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = LRUCache(2)
+        self.assertIsNone(cache.get('a'))
+        cache['a'] = 1
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b', 0), 0)
+        self.assertEqual((cache.hits, cache.misses, cache.evictions),
+                         (1, 2, 0))
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache.get('a')
+        cache['c'] = 3
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        # overwriting an entry also makes it the most recently used
+        cache['a'] = 4
+        cache['d'] = 5
+        self.assertEqual(sorted(cache.data), ['a', 'd'])
+        self.assertEqual(cache.evictions, 2)
+    def test_clear(self):
+        cache = LRUCache(1)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache.get('b')
+        cache.get('a')
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual((cache.hits, cache.misses, cache.evictions),
+                         (0, 0, 0))
+    def test_memoized_levenshtein(self):
+        rng = random.Random(7)
+        maxsize = memo.maxsize
+        try:
+            # a tiny memo evicts entries while they are still needed
+            for memo.maxsize in (maxsize, 8):
+                memo.clear()
+                for _ in range(30):
+                    s = random_string(rng, rng.randint(1, 7))
+                    t = random_string(rng, rng.randint(1, 7))
+                    self.assertEqual(levenshtein(s, t),
+                                     reference_levenshtein(s, t))
+                self.assertLessEqual(len(memo), memo.maxsize)
+                self.assertGreater(memo.hits, 0)
+        finally:
+            memo.maxsize = maxsize
+            memo.clear()
+
+
+class LevenshteinMatrixTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = random.Random(8)
+        # lengths on both sides of one and two 64-bit words
+        lengths = [1, 5, 63, 64, 65, 100, 127, 128, 129, 150]
+        cls.queries = [random_string(rng, n, 'abcd') for n in lengths[::2]]
+        cls.corpus = [random_string(rng, n, 'abcd') for n in lengths]
+        # an exact match, whose distance of 0 must still be stored
+        cls.corpus.append(cls.queries[2])
+        cls.expected = np.array([[reference_levenshtein(s, t)
+                                  for t in cls.corpus]
+                                 for s in cls.queries])
+    def test_dense(self):
+        for block_size in (3, 1 << 14):
+            matrix = levenshtein_matrix(self.queries, self.corpus,
+                                        workers=1, block_size=block_size)
+            self.assertEqual(matrix.tolist(), self.expected.tolist())
+    def test_sparse_max_dist(self):
+        for max_dist in (0, 40, 70, 100):
+            matrix = levenshtein_matrix(self.queries, self.corpus,
+                                        max_dist=max_dist, workers=1,
+                                        block_size=4)
+            coo = matrix.tocoo()
+            stored = dict(zip(zip(coo.row.tolist(), coo.col.tolist()),
+                              coo.data.tolist()))
+            within = np.argwhere(self.expected <= max_dist).tolist()
+            self.assertEqual(stored, dict(((i, j), self.expected[i, j])
+                                          for i, j in within))
+        self.assertEqual(stored[2, len(self.corpus) - 1], 0)
+    def test_worker_pool(self):
+        matrix = levenshtein_matrix(self.queries, self.corpus, workers=2,
+                                    chunk_size=2)
+        self.assertEqual(matrix.tolist(), self.expected.tolist())
+    def test_empty_strings(self):
+        matrix = levenshtein_matrix(['', 'ab'], ['', 'abc', 'b'], workers=1)
+        self.assertEqual(matrix.tolist(), [[0, 3, 1], [2, 1, 1]])
+        self.assertEqual(levenshtein_matrix([], ['a'], workers=1).shape,
+                         (0, 1))
+
+
+class FuzzyIndexTest(unittest.TestCase):
+    def test_query_matches_brute_force(self):
+        rng = random.Random(9)
+        vocabulary = [random_string(rng, rng.randint(1, 8)) for _ in range(300)]
+        index = FuzzyIndex(vocabulary)
+        self.assertEqual(len(index), len(set(vocabulary)))
+        for _ in range(30):
+            s = random_string(rng, rng.randint(1, 8))
+            distances = sorted((word, reference_levenshtein(s, word))
+                               for word in set(vocabulary))
+            for k in range(4):
+                expected = [match for match in distances if match[1] <= k]
+                matches = index.query(s, k)
+                self.assertEqual(sorted(matches), expected)
+                found = [d for _, d in matches]
+                self.assertEqual(found, sorted(found))
+    def test_add(self):
+        index = FuzzyIndex()
+        self.assertEqual(index.query('abc', 2), [])
+        self.assertTrue(index.add('abc'))
+        self.assertFalse(index.add('abc'))
+        self.assertTrue(index.add('abd'))
+        self.assertEqual(index.query('abc', 0), [('abc', 0)])
+        self.assertEqual(index.query('abc', 1), [('abc', 0), ('abd', 1)])
+    def test_pickle(self):
+        import pickle
+        index = FuzzyIndex(['book', 'books', 'cake', 'boo', 'cape', 'cart'])
+        loaded = pickle.loads(pickle.dumps(index))
+        self.assertEqual(loaded.query('boon', 1), index.query('boon', 1))
+        self.assertEqual(sorted(word for word, _ in loaded.query('cakes', 2)),
+                         ['cake', 'cape'])
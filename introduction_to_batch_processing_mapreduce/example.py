@@ -30,6 +30,9 @@ s = mincemeat.Server()
 s.datasource = datasource
 s.mapfn = mapper
 s.reducefn = reducer
+# Word counts can be summed in any grouping, so the reducer doubles as
+# the combiner.
+s.combinefn = reducer
 
 results = s.run_server(password="datawhatnow")
 print(results)
@@ -27,7 +27,9 @@ import asynchat
 import asyncore
 import cPickle as pickle
 import hashlib
+import heapq
 import hmac
+import itertools
 import logging
 import marshal
 import optparse
@@ -35,13 +37,29 @@ import os
 import random
 import socket
 import sys
+import tempfile
+import time
 import types
+import zlib
 
 VERSION = "0.1.4"
 
 
 DEFAULT_PORT = 11235
 
+# Payload encodings, by the name that goes in a frame's header. marshal is
+# much cheaper than pickle for the built-in types map and reduce results
+# are usually made of, like (str, int) pairs, but it cannot encode anything
+# else, so frames it refuses are sent with pickle instead.
+SERIALIZERS = {
+    'pickle': (lambda data: pickle.dumps(data, pickle.HIGHEST_PROTOCOL), pickle.loads),
+    'marshal': (marshal.dumps, marshal.loads),
+    }
+COMPRESSORS = {
+    'zlib': (zlib.compress, zlib.decompress),
+    }
+# Smaller payloads are not worth compressing
+COMPRESS_MIN_BYTES = 1024
 
 
 class Protocol(asynchat.async_chat):
@@ -55,16 +73,50 @@ class Protocol(asynchat.async_chat):
         self.buffer = []
         self.auth = None
         self.mid_command = False
+        # What this end encodes its payloads with. Every frame names its
+        # own encoding, so the other end can decode whatever it receives.
+        self.serializer = 'pickle'
+        self.compression = None
+        self.stats = {'frames': 0, 'bytes': 0, 'encode_seconds': 0.0, 'decode_seconds': 0.0}
 
     def collect_incoming_data(self, data):
         self.buffer.append(data)
 
+    def encode(self, data):
+        start = time.time()
+        codec = self.serializer
+        try:
+            payload = SERIALIZERS[codec][0](data)
+        except ValueError:
+            codec = 'pickle'
+            payload = SERIALIZERS[codec][0](data)
+        if self.compression and len(payload) >= COMPRESS_MIN_BYTES:
+            payload = COMPRESSORS[self.compression][0](payload)
+            codec += '+' + self.compression
+        self.stats['encode_seconds'] += time.time() - start
+        self.stats['frames'] += 1
+        self.stats['bytes'] += len(payload)
+        return codec, payload
+
+    def decode(self, codec, payload):
+        start = time.time()
+        names = codec.split('+')
+        for name in reversed(names[1:]):
+            payload = COMPRESSORS[name][1](payload)
+        data = SERIALIZERS[names[0]][1](payload)
+        self.stats['decode_seconds'] += time.time() - start
+        return data
+
     def send_command(self, command, data=None):
         if not ":" in command:
             command += ":"
         if data:
-            pdata = pickle.dumps(data)
+            # The header is command:length, followed by :codec unless the
+            # payload is a plain pickle.
+            codec, pdata = self.encode(data)
             command += str(len(pdata))
+            if codec != 'pickle':
+                command += ":" + codec
             logging.debug( "<- %s" % command)
             self.push(command + "\n" + pdata)
         else:
@@ -78,18 +130,20 @@ class Protocol(asynchat.async_chat):
         elif not self.mid_command:
             logging.debug("-> %s" % ''.join(self.buffer))
             command, length = (''.join(self.buffer)).split(":", 1)
-            if command == "challenge":
+            if command in ("challenge", "serializers", "serializer"):
                 self.process_command(command, length)
             elif length:
+                length, _, codec = length.partition(":")
                 self.set_terminator(int(length))
                 self.mid_command = command
+                self.mid_codec = codec or 'pickle'
             else:
                 self.process_command(command)
         else: # Read the data segment from the previous command
             if not self.auth == "Done":
                 logging.fatal("Recieved pickled data from unauthed source")
                 sys.exit(1)
-            data = pickle.loads(''.join(self.buffer))
+            data = self.decode(self.mid_codec, ''.join(self.buffer))
             self.set_terminator("\n")
             command = self.mid_command
             self.mid_command = None
@@ -142,7 +196,7 @@ class Protocol(asynchat.async_chat):
 class Client(Protocol):
     def __init__(self):
         Protocol.__init__(self)
-        self.mapfn = self.reducefn = self.collectfn = None
+        self.mapfn = self.reducefn = self.collectfn = self.combinefn = None
 
     def conn(self, server, port):
         self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -164,28 +218,45 @@ class Client(Protocol):
     def set_reducefn(self, command, reducefn):
         self.reducefn = types.FunctionType(marshal.loads(reducefn), globals(), 'reducefn')
 
+    def set_combinefn(self, command, combinefn):
+        self.combinefn = types.FunctionType(marshal.loads(combinefn), globals(), 'combinefn')
+
+    def set_serializer(self, command, data):
+        self.serializer, compression = data.split(":")
+        self.compression = compression or None
+        logging.info("Using serializer %s, compression %s" % (self.serializer, self.compression))
+
     def call_mapfn(self, command, data):
-        logging.info("Mapping %s" % str(data[0]))
+        task, records = data
+        logging.info("Mapping task %s (%d records)" % (task, len(records)))
         results = {}
-        for k, v in self.mapfn(data[0], data[1]):
-            if k not in results:
-                results[k] = []
-            results[k].append(v)
+        for key, value in records:
+            for k, v in self.mapfn(key, value):
+                if k not in results:
+                    results[k] = []
+                results[k].append(v)
         if self.collectfn:
             for k in results:
                 results[k] = [self.collectfn(k, results[k])]
-        self.send_command('mapdone', (data[0], results))
+        if self.combinefn:
+            for k in results:
+                results[k] = [self.combinefn(k, results[k])]
+        self.send_command('mapdone', (task, results))
 
     def call_reducefn(self, command, data):
-        logging.info("Reducing %s" % str(data[0]))
-        results = self.reducefn(data[0], data[1])
-        self.send_command('reducedone', (data[0], results))
+        task, items = data
+        logging.info("Reducing task %s (%d keys)" % (task, len(items)))
+        reducefn = self.reducefn
+        results = dict((k, reducefn(k, v)) for k, v in items)
+        self.send_command('reducedone', (task, results))
 
     def process_command(self, command, data=None):
         commands = {
             'mapfn': self.set_mapfn,
             'collectfn': self.set_collectfn,
             'reducefn': self.set_reducefn,
+            'combinefn': self.set_combinefn,
+            'serializer': self.set_serializer,
             'map': self.call_mapfn,
             'reduce': self.call_reducefn,
             }
@@ -197,6 +268,9 @@ class Client(Protocol):
 
     def post_auth_init(self):
         if not self.auth:
+            # Tell the server what this client can decode, before asking it
+            # to authenticate itself.
+            self.send_command(":".join(["serializers", ",".join(sorted(SERIALIZERS) + sorted(COMPRESSORS))]))
             self.send_challenge()
 
 
@@ -207,6 +281,34 @@ class Server(asyncore.dispatcher, object):
         self.mapfn = None
         self.reducefn = None
         self.collectfn = None
+        # combinefn(key, values) merges values into a single partial
+        # aggregate of the same kind, e.g. the reducefn of a word count.
+        # It runs on every client's map output and again on the server as
+        # partial aggregates arrive, so it must give the same result
+        # however the values are grouped.
+        self.combinefn = None
+        # The intermediate keys are hashed into this many partitions, which
+        # are merged back from the spilled runs one at a time.
+        self.reduce_partitions = 16
+        # The merged key groups are sent to the clients in reduce tasks of
+        # whole keys holding at least this many values (a task is only
+        # bigger than that by its last key), so the reduce phase keeps at
+        # most max_outstanding_tasks of them per client in memory.
+        self.reduce_batch_size = 100000
+        # Once the map results hold more than this many values in memory
+        # they are spilled to a sorted run file in spill_directory (the
+        # system temporary directory if None). None never spills.
+        self.spill_threshold = 1000000
+        self.spill_directory = None
+        # Each map task carries this many records from the datasource, and
+        # each client is sent up to max_outstanding_tasks tasks ahead so it
+        # never sits idle waiting for the next one to arrive.
+        self.map_batch_size = 1
+        self.max_outstanding_tasks = 2
+        # Payload encodings in order of preference; each client gets the
+        # first one it supports, and compression if it supports it.
+        self.serializers = ['marshal', 'pickle']
+        self.compression = None
         self.datasource = None
         self.password = None
 
@@ -246,34 +348,57 @@ class ServerChannel(Protocol):
     def __init__(self, conn, map, server):
         Protocol.__init__(self, conn, map=map)
         self.server = server
+        # (command, task id) of the tasks sent to this client and not done yet
+        self.outstanding = set()
+        self.negotiated = False
 
         self.start_auth()
 
     def handle_close(self):
-        logging.info("Client disconnected")
+        logging.info("Client disconnected (sent %(frames)d frames, %(bytes)d bytes, "
+                     "%(encode_seconds).3fs encoding, %(decode_seconds).3fs decoding)"
+                     % self.stats)
         self.close()
 
+    def choose_serializer(self, command, data):
+        supported = data.split(",")
+        for name in self.server.serializers:
+            if name in supported and name in SERIALIZERS:
+                self.serializer = name
+                break
+        if self.server.compression in supported:
+            self.compression = self.server.compression
+        self.negotiated = True
+
     def start_auth(self):
         self.send_challenge()
 
-    def start_new_task(self):
-        command, data = self.server.taskmanager.next_task(self)
-        if command == None:
-            return
-        self.send_command(command, data)
+    def start_new_tasks(self):
+        # Tops this client up to max_outstanding_tasks unfinished tasks.
+        while len(self.outstanding) < max(1, self.server.max_outstanding_tasks):
+            command, data = self.server.taskmanager.next_task(self)
+            if command == None:
+                return
+            self.send_command(command, data)
+            if command not in ('map', 'reduce'):
+                return
+            self.outstanding.add((command, data[0]))
 
     def map_done(self, command, data):
+        self.outstanding.discard(('map', data[0]))
         self.server.taskmanager.map_done(data)
-        self.start_new_task()
+        self.start_new_tasks()
 
     def reduce_done(self, command, data):
+        self.outstanding.discard(('reduce', data[0]))
         self.server.taskmanager.reduce_done(data)
-        self.start_new_task()
+        self.start_new_tasks()
 
     def process_command(self, command, data=None):
         commands = {
             'mapdone': self.map_done,
             'reducedone': self.reduce_done,
+            'serializers': self.choose_serializer,
             }
 
         if command in commands:
@@ -282,13 +407,17 @@ class ServerChannel(Protocol):
             Protocol.process_command(self, command, data)
 
     def post_auth_init(self):
+        if self.negotiated:
+            self.send_command(":".join(["serializer", self.serializer, self.compression or ""]))
         if self.server.mapfn:
             self.send_command('mapfn', marshal.dumps(self.server.mapfn.func_code))
         if self.server.reducefn:
             self.send_command('reducefn', marshal.dumps(self.server.reducefn.func_code))
         if self.server.collectfn:
             self.send_command('collectfn', marshal.dumps(self.server.collectfn.func_code))
-        self.start_new_task()
+        if self.server.combinefn:
+            self.send_command('combinefn', marshal.dumps(self.server.combinefn.func_code))
+        self.start_new_tasks()
 
 class TaskManager:
     START = 0
@@ -304,47 +433,65 @@ class TaskManager:
     def next_task(self, channel):
         if self.state == TaskManager.START:
             self.map_iter = iter(self.datasource)
+            self.map_tasks = itertools.count()
             self.working_maps = {}
-            self.map_results = {}
+            self.map_results = IntermediateStore(self.server.reduce_partitions,
+                                                 self.server.combinefn,
+                                                 self.server.spill_threshold,
+                                                 self.server.spill_directory)
             #self.waiting_for_maps = []
             self.state = TaskManager.MAPPING
         if self.state == TaskManager.MAPPING:
-            try:
-                map_key = self.map_iter.next()
-                map_item = map_key, self.datasource[map_key]
-                self.working_maps[map_item[0]] = map_item[1]
-                return ('map', map_item)
-            except StopIteration:
-                if len(self.working_maps) > 0:
-                    key = random.choice(self.working_maps.keys())
-                    return ('map', (key, self.working_maps[key]))
-                self.state = TaskManager.REDUCING
-                self.reduce_iter = self.map_results.iteritems()
-                self.working_reduces = {}
-                self.results = {}
+            records = [(map_key, self.datasource[map_key]) for map_key in
+                       itertools.islice(self.map_iter, max(1, self.server.map_batch_size))]
+            if records:
+                task = self.map_tasks.next()
+                self.working_maps[task] = records
+                return ('map', (task, records))
+            if len(self.working_maps) > 0:
+                task = self.straggler(channel, 'map', self.working_maps)
+                if task is None:
+                    return (None, None)
+                return ('map', (task, self.working_maps[task]))
+            self.state = TaskManager.REDUCING
+            self.reduce_iter = self.map_results.batches(max(1, self.server.reduce_batch_size))
+            self.reduce_tasks = itertools.count()
+            self.working_reduces = {}
+            self.results = {}
         if self.state == TaskManager.REDUCING:
             try:
-                reduce_item = self.reduce_iter.next()
-                self.working_reduces[reduce_item[0]] = reduce_item[1]
-                return ('reduce', reduce_item)
+                items = self.reduce_iter.next()
+                task = self.reduce_tasks.next()
+                self.working_reduces[task] = items
+                return ('reduce', (task, items))
             except StopIteration:
                 if len(self.working_reduces) > 0:
-                    key = random.choice(self.working_reduces.keys())
+                    key = self.straggler(channel, 'reduce', self.working_reduces)
+                    if key is None:
+                        return (None, None)
                     return ('reduce', (key, self.working_reduces[key]))
                 self.state = TaskManager.FINISHED
+                self.map_results.close()
         if self.state == TaskManager.FINISHED:
             self.server.handle_close()
             return ('disconnect', None)
 
+    def straggler(self, channel, command, working):
+        # Once every task has been handed out, unfinished ones are sent again
+        # in case their client died, but never to a client that already has
+        # them; that client will ask again when one of its tasks is done.
+        tasks = [task for task in working if (command, task) not in channel.outstanding]
+        if not tasks:
+            return None
+        return random.choice(tasks)
+
     def map_done(self, data):
         # Don't use the results if they've already been counted
         if not data[0] in self.working_maps:
             return
 
         for (key, values) in data[1].iteritems():
-            if key not in self.map_results:
-                self.map_results[key] = []
-            self.map_results[key].extend(values)
+            self.map_results.add(key, values)
         del self.working_maps[data[0]]
 
     def reduce_done(self, data):
@@ -352,9 +499,197 @@ class TaskManager:
         if not data[0] in self.working_reduces:
             return
 
-        self.results[data[0]] = data[1]
+        self.results.update(data[1])
         del self.working_reduces[data[0]]
 
+class IntermediateStore(object):
+    """
+    Holds the intermediate (key, values) pairs of the map phase, hashed into
+    a number of reduce partitions. Whenever more than spill_threshold values
+    are held in memory, they are written out to a temporary file as a run
+    sorted by (partition, key), which bounds the memory the map phase needs.
+    The reduce phase reads one partition at a time back with a k-way merge
+    of the runs and whatever is still in memory, and hands the merged key
+    groups out in batches of a bounded number of values, so the server only
+    holds the batches that are out for reducing rather than whole
+    partitions.
+    Runs are merged by size tier: a spill is a level 0 run, and as soon as
+    MERGE_FACTOR runs of one level exist they are merged into a single run of
+    the next level. Each value is therefore rewritten once per level, a
+    logarithmic number of times, and no merge holds more than MERGE_FACTOR - 1
+    files open per level.
+    """
+    MERGE_FACTOR = 8
+
+    def __init__(self, partitions, combinefn=None, spill_threshold=None, directory=None):
+        self.partition_count = max(1, partitions)
+        self.combinefn = combinefn
+        self.spill_threshold = spill_threshold
+        self.directory = directory
+        self.buffer = {}
+        self.buffered = 0
+        # One (path, {partition: (offset, record count)}) per spilled run,
+        # and the tier level of each; levels never increase along the list.
+        self.runs = []
+        self.levels = []
+
+    def partition(self, key):
+        return hash(key) % self.partition_count
+
+    def add(self, key, values):
+        current = self.buffer.get(key)
+        if current is None:
+            current = self.buffer[key] = []
+        before = len(current)
+        current.extend(values)
+        if self.combinefn and len(current) > 1:
+            current[:] = [self.combinefn(key, current)]
+        self.buffered += len(current) - before
+        if self.spill_threshold is not None and self.buffered > self.spill_threshold:
+            self.spill()
+
+    def sorted_buffer(self):
+        keys = [(self.partition(key), key) for key in self.buffer]
+        keys.sort()
+        return keys
+
+    def write_run(self, records):
+        """
+        Writes (partition, key, values) records, sorted by (partition, key),
+        to a new run file and returns its (path, offsets) entry.
+        """
+        fd, path = tempfile.mkstemp(prefix='mincemeat-', suffix='.run',
+                                    dir=self.directory)
+        offsets = {}
+        f = os.fdopen(fd, 'wb')
+        try:
+            for partition, key, values in records:
+                if partition not in offsets:
+                    offsets[partition] = (f.tell(), 0)
+                start, count = offsets[partition]
+                offsets[partition] = (start, count + 1)
+                pickle.dump((key, values), f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        return path, offsets
+
+    def spill(self):
+        if not self.buffer:
+            return
+        self.runs.append(self.write_run((partition, key, self.buffer[key])
+                                        for partition, key in self.sorted_buffer()))
+        self.levels.append(0)
+        logging.info("Spilled %d values to %s" % (self.buffered, self.runs[-1][0]))
+        self.buffer = {}
+        self.buffered = 0
+        while (len(self.levels) >= self.MERGE_FACTOR
+               and self.levels[-self.MERGE_FACTOR] == self.levels[-1]):
+            self.merge_last(self.MERGE_FACTOR)
+
+    def merge_last(self, count):
+        """
+        Replaces the last count runs, which all have the same level, with a
+        single run of the next level.
+        """
+        runs = self.runs[-count:]
+        level = self.levels[-1] + 1
+        partitions = set()
+        for path, offsets in runs:
+            partitions.update(offsets)
+        records = ((partition, key, values)
+                   for partition in sorted(partitions)
+                   for key, values in self.group_keys(self.merge_runs(runs, partition)))
+        merged = self.write_run(records)
+        del self.runs[-count:]
+        del self.levels[-count:]
+        self.runs.append(merged)
+        self.levels.append(level)
+        for path, offsets in runs:
+            os.remove(path)
+
+    def read_run(self, path, offset, count, run):
+        f = open(path, 'rb')
+        try:
+            f.seek(offset)
+            for _ in xrange(count):
+                key, values = pickle.load(f)
+                yield key, run, values
+        finally:
+            f.close()
+
+    def merge_runs(self, runs, partition, extra=()):
+        # The run index breaks ties between equal keys, so values are
+        # never compared.
+        sources = [self.read_run(path, offsets[partition][0], offsets[partition][1], run)
+                   for run, (path, offsets) in enumerate(runs)
+                   if partition in offsets]
+        sources.append(iter(extra))
+        return heapq.merge(*sources)
+
+    def batches(self, max_values):
+        """
+        Yields lists of (key, values) pairs covering every key once, each
+        list holding whole keys and closed as soon as it reaches max_values
+        values. Only the merge state and the current list are in memory.
+        """
+        batch = []
+        count = 0
+        for partition, key, values in self.partitions():
+            batch.append((key, values))
+            count += len(values)
+            if count >= max_values:
+                yield batch
+                batch = []
+                count = 0
+        if batch:
+            yield batch
+
+    def partitions(self):
+        """
+        Yields (partition, key, values) for every key, partition by
+        partition and in key order within each, merging the values of a
+        key from every run as it goes.
+        """
+        in_memory = {}
+        for partition, key in self.sorted_buffer():
+            in_memory.setdefault(partition, []).append((key, len(self.runs), self.buffer[key]))
+        self.buffer = {}
+        self.buffered = 0
+        nonempty = set(in_memory)
+        for path, offsets in self.runs:
+            nonempty.update(offsets)
+        for partition in sorted(nonempty):
+            records = self.merge_runs(self.runs, partition, in_memory.pop(partition, []))
+            for key, values in self.group_keys(records):
+                yield partition, key, values
+
+    def group_keys(self, records):
+        """
+        Joins the values of adjacent records with equal keys from a merged
+        stream of (key, run, values) records, yielding (key, values).
+        """
+        current_key = current = None
+        for key, run, values in records:
+            if current is not None and current_key == key:
+                current.extend(values)
+                if self.combinefn:
+                    current[:] = [self.combinefn(key, current)]
+            else:
+                if current is not None:
+                    yield current_key, current
+                current_key, current = key, list(values)
+        if current is not None:
+            yield current_key, current
+
+    def close(self):
+        for path, offsets in self.runs:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.runs = []
+        self.levels = []
+
 def run_client():
     parser = optparse.OptionParser(usage="%prog [options]", version="%%prog %s"%VERSION)
     parser.add_option("-p", "--password", dest="password", default="", help="password")